@@ -0,0 +1,514 @@
+'''
+
+Benchmarks for the indexing and query pipeline.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import time
+import random
+import platform
+import statistics
+import tracemalloc
+import subprocess
+import multiprocessing
+from os.path import exists
+from build_index import read_documents
+from build_index import build_index
+from build_index import build_indexes
+from build_index import build_statistics
+from build_index import split_index
+from shards import ShardedEngine
+from evaluation import read_queries
+import preprocessing
+import query
+import utils
+import topk
+
+def scaled_documents(documents, factor):
+    '''
+    Builds a larger collection by repeating every document 'factor'
+    times under fresh docIDs.
+    '''
+    assert type(documents) == dict
+
+    scaled = {}
+    offset = max(documents)
+
+    # each copy shifts the docIDs past the previous copy, so postings
+    # stay in increasing docID order.
+    for copy in range(factor):
+        for docID in documents:
+            scaled[docID + copy * offset] = documents[docID]
+
+    return scaled
+
+def benchmark_build(collection, method, factors):
+    '''
+    Times build_index on growing copies of the collection and returns
+    a list of (number of documents, seconds, seconds per document).
+    '''
+    documents = read_documents(collection)
+    results = []
+
+    for factor in factors:
+        scaled = scaled_documents(documents, factor)
+
+        start = time.perf_counter()
+        build_index(scaled, method)
+        elapsed = time.perf_counter() - start
+
+        results.append((len(scaled), elapsed, elapsed / len(scaled)))
+
+    return results
+
+def benchmark_workers(collection, factor, worker_counts):
+    '''
+    Times building both indexes with two separate build_index calls, and
+    with build_indexes (one tokenization pass) over growing numbers of
+    worker processes. Returns a list of (label, seconds).
+    '''
+    documents = scaled_documents(read_documents(collection), factor)
+    results = []
+
+    start = time.perf_counter()
+    build_index(documents, 'l')
+    build_index(documents, 's')
+    results.append(('build_index x2', time.perf_counter() - start))
+
+    for workers in worker_counts:
+        start = time.perf_counter()
+        build_indexes(documents, ['l', 's'], workers)
+        results.append(('build_indexes, ' + str(workers) + ' workers', time.perf_counter() - start))
+
+    return results
+
+def benchmark_pruning(collection, method, schemes, ks):
+    '''
+    Scores every query exhaustively (term-at-a-time) and with MaxScore,
+    and returns a list of (scheme, k, identical, exhaustive postings,
+    pruned postings, exhaustive seconds, pruned seconds).
+    '''
+    index = query.read_index(collection, method)
+    statistics = query.read_statistics(collection, method)
+    bounds = query.read_bounds(collection, method)
+    queries = read_queries(collection)
+    results = []
+
+    for scheme in schemes:
+        for k in ks:
+            query.counters['postings'] = 0
+            start = time.perf_counter()
+            exhaustive = [query.tokenize_and_answer(queries[i], scheme[0], scheme[1], scheme[2], k, method, index, statistics, 'taat') for i in queries]
+            exhaustive_time = time.perf_counter() - start
+
+            # exhaustive scoring touches every posting of the query terms.
+            exhaustive_postings = 0
+            for i in queries:
+                for token in query.build_query_vector(queries[i], 'lemmatization' if method == 'l' else 'stemming'):
+                    if token in index:
+                        exhaustive_postings += index[token][0]
+
+            query.counters['postings'] = 0
+            start = time.perf_counter()
+            pruned = [query.tokenize_and_answer(queries[i], scheme[0], scheme[1], scheme[2], k, method, index, statistics, 'maxscore', bounds) for i in queries]
+            pruned_time = time.perf_counter() - start
+
+            results.append((scheme, k, exhaustive == pruned, exhaustive_postings, query.counters['postings'], exhaustive_time, pruned_time))
+
+    return results
+
+def benchmark_shards(collection, method, factor, shard_counts, scheme, k):
+    '''
+    Builds an index over 'factor' copies of the collection, and scores
+    the query set on it unsharded and split into growing numbers of
+    shards. Returns a list of (shards, identical, queries per second).
+    '''
+    index = build_index(scaled_documents(read_documents(collection), factor), method)
+    statistics = build_statistics(index)
+    queries = read_queries(collection)
+    keyword_queries = [queries[i] for i in sorted(queries)]
+
+    start = time.perf_counter()
+    expected = [query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, statistics) for keyword_query in keyword_queries]
+    results = [(1, True, len(keyword_queries) / (time.perf_counter() - start))]
+
+    for shards in shard_counts:
+        # the shards are handed to the workers in memory.
+        engine = ShardedEngine(collection, method, split_index(index, statistics, shards)[0])
+        start = time.perf_counter()
+        answers = engine.answer_batch(keyword_queries, scheme, k)
+        elapsed = time.perf_counter() - start
+        engine.close()
+
+        results.append((shards, answers == expected, len(keyword_queries) / elapsed))
+
+    return results
+
+def benchmark_topk(size, ks):
+    '''
+    Times the old selector (utils.heap and utils.largest) against the
+    bounded heap and the argpartition selectors of topk.py on random
+    scores with many ties, and returns a list of (k, identical, old
+    seconds, heap seconds, dense seconds).
+    '''
+    import numpy as np
+
+    # scores rounded to 3 decimals, so ties are common.
+    random.seed(0)
+    scores = {docID: round(random.random(), 3) for docID in range(1, size + 1)}
+    dense_scores = np.array(list(scores.values()))
+    dense_docIDs = np.array(list(scores.keys()))
+    results = []
+
+    for k in ks:
+        start = time.perf_counter()
+        old = utils.largest(utils.heap(scores), k)
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = topk.select(scores.items(), k)
+        heap_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dense = topk.select_dense(dense_scores, dense_docIDs, k)
+        dense_time = time.perf_counter() - start
+
+        results.append((k, old == new == dense, old_time, heap_time, dense_time))
+
+    return results
+
+def benchmark_normalization(collection):
+    '''
+    Normalizes every token of the collection with and without the
+    normalization cache, and returns a list of (method, tokens, hit
+    rate, uncached seconds, cached seconds) for stemming and
+    lemmatization.
+    '''
+    documents = read_documents(collection)
+    tokens = [preprocessing.tokenize(documents[docID]) for docID in documents]
+    results = []
+
+    for method, function in [('stemming', preprocessing.get_stemmer().stem), ('lemmatization', preprocessing.get_lemmatizer().lemmatize)]:
+        start = time.perf_counter()
+        for document in tokens:
+            [function(token.lower()) for token in document]
+        uncached_time = time.perf_counter() - start
+
+        # starting from an empty cache, as build_index does.
+        cache = preprocessing.caches[method]
+        cache.clear()
+        start = time.perf_counter()
+        for document in tokens:
+            preprocessing.normalize(document, method)
+        cached_time = time.perf_counter() - start
+
+        results.append((method, sum(len(document) for document in tokens), cache.hit_rate(), uncached_time, cached_time))
+
+    return results
+
+def benchmark_startup(modules, repeats):
+    '''
+    Times a cold interpreter importing each module, and returns a list
+    of (module, fastest seconds).
+    '''
+    results = []
+
+    for module in modules:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.check_output(["python3", "-c", "import sys; sys.path.insert(0, './code'); import " + module])
+            timings.append(time.perf_counter() - start)
+        results.append((module, min(timings)))
+
+    return results
+
+def benchmark_lazy(collection, method, keyword_query, repeats):
+    '''
+    Times a cold process answering a single query with the whole json
+    index loaded and with the lazy reader, and returns a list of (reader,
+    fastest seconds to the first result, peak resident memory in MB).
+    '''
+    results = []
+
+    for lazy in [False, True]:
+        # the statistics table is left out of both, as query.py --lazy
+        # does for vector scoring.
+        program = ("import sys, time, resource; sys.path.insert(0, './code'); start = time.perf_counter(); import query; "
+                   "index = query.read_index(sys.argv[1], sys.argv[2], sys.argv[3] == 'True'); "
+                   "query.tokenize_and_answer(sys.argv[4], 'l', 't', 'c', 10, sys.argv[2], index); "
+                   "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+
+        timings, memory = [], []
+        for _ in range(repeats):
+            output = subprocess.check_output(["python3", "-c", program, collection, method, str(lazy), keyword_query])
+            elapsed, peak = output.decode('utf-8').split()[-2:]
+            timings.append(float(elapsed))
+            memory.append(int(peak) / 1024)
+
+        results.append(('lazy' if lazy else 'json', min(timings), min(memory)))
+
+    return results
+
+# the suite samples its queries with a fixed seed, so every run scores
+# the same queries.
+SEED = 0
+SAMPLE_SIZE = 50
+
+# every valid 'ddd' scheme (full-vector cosine isn't available for BM25).
+SCHEMES = [tf + idf + norm for tf in ['l', 'n', 'b'] for idf in ['t', 'n'] for norm in ['c', 'n', 'f'] if tf + norm != 'bf']
+SUITE_KS = [10, 860, 1710]
+
+# the relative change beyond which a metric is reported as a regression.
+TOLERANCE = 0.10
+
+def suite_build(collection, methods):
+    '''
+    Times read_documents + build_index for every method, and measures
+    the peak memory of a second, traced run (tracing slows the build
+    down). Returns method -> {'seconds', 'peak_mb'}.
+    '''
+    results = {}
+
+    for method in methods:
+        name = 'lemmatization' if method == 'l' else 'stemming'
+
+        # both runs start from an empty normalization cache.
+        preprocessing.caches[name].clear()
+        start = time.perf_counter()
+        build_index(read_documents(collection), method)
+        elapsed = time.perf_counter() - start
+
+        preprocessing.caches[name].clear()
+        tracemalloc.start()
+        build_index(read_documents(collection), method)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[method] = {'seconds': elapsed, 'peak_mb': peak / (1024 * 1024)}
+
+    return results
+
+def suite_load(collection, method, repeats):
+    '''
+    Times read_index and read_statistics, and returns the fastest and
+    median seconds of each.
+    '''
+    results = {}
+
+    for name, function in [('read_index', query.read_index), ('read_statistics', query.read_statistics)]:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function(collection, method)
+            timings.append(time.perf_counter() - start)
+        results[name] = {'min_seconds': min(timings), 'median_seconds': statistics.median(timings)}
+
+    return results
+
+def suite_latency(keyword_queries, method, index, document_statistics, scheme, k):
+    '''
+    Times every query on its own, and returns the latency percentiles in
+    milliseconds.
+    '''
+    latencies = []
+
+    for keyword_query in keyword_queries:
+        start = time.perf_counter()
+        query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, document_statistics)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {'p50_ms': utils.percentile(latencies, 50), 'p90_ms': utils.percentile(latencies, 90),
+            'p99_ms': utils.percentile(latencies, 99), 'max_ms': max(latencies)}
+
+def suite_throughput(keyword_queries, method, index, document_statistics, schemes, ks):
+    '''
+    Scores the batch of queries for every scheme and k, and returns
+    scheme -> k -> queries per second.
+    '''
+    results = {}
+
+    for scheme in schemes:
+        results[scheme] = {}
+        for k in ks:
+            start = time.perf_counter()
+            for keyword_query in keyword_queries:
+                query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, document_statistics)
+            results[scheme][str(k)] = len(keyword_queries) / (time.perf_counter() - start)
+
+    return results
+
+def run_suite(collection, method):
+    '''
+    Runs the whole suite, and returns the results with the environment
+    they were measured in.
+    '''
+    results = {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': multiprocessing.cpu_count()},
+        'collection': collection,
+        'method': method,
+        'seed': SEED,
+        'build': suite_build(collection, ['l', 's']),
+        'load': suite_load(collection, method, 5)
+    }
+
+    index = query.read_index(collection, method)
+    document_statistics = query.read_statistics(collection, method)
+
+    # the same sample of queries for every measure.
+    queries = read_queries(collection)
+    sample = random.Random(SEED).sample(sorted(queries), min(SAMPLE_SIZE, len(queries)))
+    keyword_queries = [queries[i] for i in sample]
+
+    # scoring the sample once first, so the normalization cache is warm
+    # for every measure.
+    suite_throughput(keyword_queries, method, index, document_statistics, ['ltc'], [10])
+
+    results['latency'] = {str(k): suite_latency(keyword_queries, method, index, document_statistics, 'ltc', k) for k in SUITE_KS}
+    results['throughput'] = suite_throughput(keyword_queries, method, index, document_statistics, SCHEMES, SUITE_KS)
+    return results
+
+def flatten(results, prefix = ''):
+    '''
+    Flattens the nested numeric results into metric name -> value.
+    '''
+    metrics = {}
+    for name, value in results.items():
+        if type(value) == dict:
+            metrics.update(flatten(value, prefix + name + '.'))
+        elif type(value) in [int, float] and name not in ['seed', 'cpus']:
+            metrics[prefix + name] = value
+    return metrics
+
+def compare_results(baseline, current, tolerance = TOLERANCE):
+    '''
+    Compares every metric of the current results with the baseline, and
+    returns a list of (metric, baseline, current, relative change,
+    regression). Throughput is better when higher, every other metric
+    (seconds, milliseconds, megabytes) when lower.
+    '''
+    baseline_metrics, current_metrics = flatten(baseline), flatten(current)
+    comparison = []
+
+    for metric in sorted(baseline_metrics.keys() & current_metrics.keys()):
+        before, after = baseline_metrics[metric], current_metrics[metric]
+        change = (after - before) / before if before != 0 else 0
+
+        if metric.startswith('throughput.'):
+            regression = change < -tolerance
+        else:
+            regression = change > tolerance
+        comparison.append((metric, before, after, change, regression))
+
+    return comparison
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> benchmark name (suite, build, workers, pruning, shards,
+                   topk, normalization, startup or lazy)
+    sys.argv[2] -> collection name
+    sys.argv[3] -> lemmatization (l) or stemming (s)
+    --output=FILE -> where the suite writes its results (defaults to
+                     benchmark_results.json)
+    --baseline=FILE -> results of a previous suite run to compare with
+    eg. python3 ./code/benchmark.py build CISI_simplified s
+    eg. python3 ./code/benchmark.py suite CISI_simplified s --baseline=baseline.json
+    '''
+    # removing the optional flags before checking the arguments.
+    output_file = 'benchmark_results.json'
+    baseline_file = None
+    for argument in sys.argv[1:]:
+        if argument.startswith('--output='):
+            output_file = argument[9:]
+        elif argument.startswith('--baseline='):
+            baseline_file = argument[11:]
+    sys.argv = [argument for argument in sys.argv if not argument.startswith('--')]
+
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 4:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[3] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    if sys.argv[1] == 'suite':
+        # checks if it is a valid file, before the suite runs.
+        if baseline_file is not None and not exists(baseline_file):
+            print("- Error: File Doesn't Exist. -")
+            sys.exit(1)
+
+        results = run_suite(sys.argv[2], sys.argv[3])
+        file = open(output_file, 'w')
+        json.dump(results, file, indent = 2)
+        file.close()
+        print("Results Written To " + output_file)
+
+        if baseline_file is not None:
+            file = open(baseline_file)
+            baseline = json.load(file)
+            file.close()
+
+            # a regression makes the run fail, so it can gate a pull request.
+            print('metric', '\t', 'baseline', '\t', 'current', '\t', 'change')
+            comparison = compare_results(baseline, results)
+            for metric, before, after, change, regression in comparison:
+                print(metric, '\t', round(before, 4), '\t', round(after, 4), '\t', '%+.1f%%' % (change * 100), '\t', 'REGRESSION' if regression else '')
+            if any(regression for metric, before, after, change, regression in comparison):
+                sys.exit(1)
+    elif sys.argv[1] == 'build':
+        # the time per document should stay flat as the collection grows
+        # if the build is linear in the corpus size.
+        print('documents', '\t', 'seconds', '\t', 'seconds/document')
+        for size, elapsed, per_document in benchmark_build(sys.argv[2], sys.argv[3], [1, 2, 4, 8]):
+            print(size, '\t', round(elapsed, 3), '\t', '%.2e' % per_document)
+    elif sys.argv[1] == 'workers':
+        # both indexes are built, whatever the method given.
+        print('build', '\t', 'seconds')
+        for label, elapsed in benchmark_workers(sys.argv[2], 2, [1, 2, 4, 8]):
+            print(label, '\t', round(elapsed, 3))
+    elif sys.argv[1] == 'pruning':
+        # the pruned results must be identical to exhaustive scoring.
+        print('scheme', '\t', 'k', '\t', 'identical', '\t', 'postings (exhaustive / pruned)', '\t', 'seconds (exhaustive / pruned)')
+        for scheme, k, identical, exhaustive_postings, pruned_postings, exhaustive_time, pruned_time in benchmark_pruning(sys.argv[2], sys.argv[3], ['ltn', 'lnn', 'nnn', 'ntn', 'btn', 'bnn'], [10, 860, 1710]):
+            print(scheme, '\t', k, '\t', identical, '\t', exhaustive_postings, '/', pruned_postings, '\t', round(exhaustive_time, 3), '/', round(pruned_time, 3))
+    elif sys.argv[1] == 'shards':
+        # the throughput should grow with the number of shards, up to the
+        # number of cores.
+        print('shards', '\t', 'identical', '\t', 'queries/s')
+        for shards, identical, throughput in benchmark_shards(sys.argv[2], sys.argv[3], 8, [2, 4, 8], 'ltc', 10):
+            print(shards, '\t', identical, '\t', round(throughput, 1))
+    elif sys.argv[1] == 'topk':
+        # the collection and method are not used, the scores are random.
+        print('k', '\t', 'identical', '\t', 'seconds (old / heap / dense)')
+        for k, identical, old_time, heap_time, dense_time in benchmark_topk(100000, [10, 860, 1710, 10000]):
+            print(k, '\t', identical, '\t', round(old_time, 4), '/', round(heap_time, 4), '/', round(dense_time, 4))
+    elif sys.argv[1] == 'normalization':
+        # both methods are measured, whatever the method given.
+        print('method', '\t', 'tokens', '\t', 'hit rate', '\t', 'seconds (uncached / cached)')
+        for method, tokens, hit_rate, uncached_time, cached_time in benchmark_normalization(sys.argv[2]):
+            print(method, '\t', tokens, '\t', round(hit_rate, 4), '\t', round(uncached_time, 3), '/', round(cached_time, 3))
+    elif sys.argv[1] == 'startup':
+        # the cold import time, which every query.py process pays.
+        print('module', '\t', 'seconds')
+        for module, elapsed in benchmark_startup(['preprocessing', 'query', 'evaluation'], 5):
+            print(module, '\t', round(elapsed, 3))
+    elif sys.argv[1] == 'lazy':
+        # a three term query, read with the index_reader.py term table.
+        print('reader', '\t', 'seconds to first result', '\t', 'peak memory (MB)')
+        for reader, elapsed, peak in benchmark_lazy(sys.argv[2], sys.argv[3], 'information retrieval systems', 5):
+            print(reader, '\t', round(elapsed, 3), '\t', round(peak, 1))
+    else:
+        print("- Error: Unknown Benchmark. -")
+        sys.exit(1)
+
+    exit(0)
@@ -0,0 +1,269 @@
+'''
+
+Compact binary format for the inverted index.
+
+The file holds a header with collection statistics, a fixed-width table
+of the terms (sorted), the term strings and the postings. DocIDs are
+delta-encoded and every integer is varint-encoded. The index is opened
+with mmap, so only the postings a query touches get decoded.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import mmap
+import struct
+from os.path import exists
+
+MAGIC = b'IRIX'
+VERSION = 1
+
+# magic, version, number of terms, number of documents, total postings,
+# total tokens, offsets of the term table, term strings and postings.
+HEADER = struct.Struct('<4sIIIQQQQQ')
+
+# offset and length of the term string, df, offset and length of the
+# postings.
+ENTRY = struct.Struct('<QIIQQ')
+
+def encode_varint(value, buffer):
+    '''
+    Appends a non-negative integer to the buffer, 7 bits per byte.
+    '''
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def decode_varint(data, position):
+    '''
+    Decodes the varint starting at position, and returns the value with
+    the position of the next byte.
+    '''
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def encode_postings(postings):
+    '''
+    Encodes a list of [docID, tf, [positions]], sorted by docID, as docID
+    gaps, tfs and position gaps.
+    '''
+    buffer = bytearray()
+    previous_docID = 0
+
+    for docID, tf, positions in postings:
+        assert docID >= previous_docID, "postings must be sorted by docID"
+        encode_varint(docID - previous_docID, buffer)
+        encode_varint(tf, buffer)
+        previous_docID = docID
+
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, buffer)
+            previous_position = position
+
+    return bytes(buffer)
+
+def decode_postings(data, start, end):
+    '''
+    Decodes the postings between start and end back into a list of
+    [docID, tf, [positions]].
+    '''
+    postings = []
+    position = start
+    docID = 0
+
+    while position < end:
+        gap, position = decode_varint(data, position)
+        tf, position = decode_varint(data, position)
+        docID += gap
+
+        positions = []
+        current = 0
+        for _ in range(tf):
+            gap, position = decode_varint(data, position)
+            current += gap
+            positions.append(current)
+
+        postings.append([docID, tf, positions])
+
+    return postings
+
+def write_binary_index(collection, index, method):
+    '''
+    Writes the index to the processed folder in the binary format.
+    '''
+
+    assert type(index) == dict
+    extension = '.idx'
+    index_file = './processed/' + collection + '_' + method + extension
+
+    # checks if it is a valid file.
+    if exists(index_file):
+        print("- Error: Processed File Already Exists. -")
+        sys.exit(1)
+
+    # the terms are sorted by their encoded bytes, which is the order
+    # used by the binary search in BinaryIndex.
+    terms = sorted(index, key = lambda term: term.encode('utf-8'))
+
+    strings = bytearray()
+    postings = bytearray()
+    entries = []
+    documents = set()
+    total_postings, total_tokens = 0, 0
+
+    for term in terms:
+        encoded_term = term.encode('utf-8')
+        encoded_postings = encode_postings(index[term][1])
+
+        entries.append((len(strings), len(encoded_term), index[term][0], len(postings), len(encoded_postings)))
+        strings += encoded_term
+        postings += encoded_postings
+
+        # collecting the collection statistics stored in the header.
+        for doc_details in index[term][1]:
+            documents.add(doc_details[0])
+            total_tokens += doc_details[1]
+        total_postings += len(index[term][1])
+
+    table_offset = HEADER.size
+    terms_offset = table_offset + ENTRY.size * len(entries)
+    postings_offset = terms_offset + len(strings)
+
+    file = open(index_file, 'wb')
+    file.write(HEADER.pack(MAGIC, VERSION, len(terms), len(documents), total_postings, total_tokens,
+                           table_offset, terms_offset, postings_offset))
+    for entry in entries:
+        file.write(ENTRY.pack(*entry))
+    file.write(strings)
+    file.write(postings)
+    file.close()
+
+class BinaryIndex:
+    '''
+    Read-only, memory mapped view of a binary index that behaves like
+    the term -> [df, postings] dictionary read from the json file.
+    '''
+
+    def __init__(self, index_file):
+        self.file = open(index_file, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        (magic, version, self.num_terms, self.num_documents, self.total_postings, self.total_tokens,
+         self.table_offset, self.terms_offset, self.postings_offset) = HEADER.unpack_from(self.data, 0)
+
+        # checks if it is a valid file.
+        if magic != MAGIC or version != VERSION:
+            print("- Error: Invalid Binary Index. -")
+            sys.exit(1)
+
+    def entry(self, position):
+        '''
+        Returns the term table entry at the given position.
+        '''
+        return ENTRY.unpack_from(self.data, self.table_offset + ENTRY.size * position)
+
+    def term(self, entry):
+        '''
+        Returns the encoded term of a term table entry.
+        '''
+        start = self.terms_offset + entry[0]
+        return self.data[start:start + entry[1]]
+
+    def find(self, term):
+        '''
+        Binary searches the term table, and returns the entry of the
+        term or None if it is not in the index.
+        '''
+        encoded_term = term.encode('utf-8')
+        low, high = 0, self.num_terms
+
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.entry(middle)
+            current = self.term(entry)
+
+            if current == encoded_term:
+                return entry
+            if current < encoded_term:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def postings(self, entry):
+        '''
+        Decodes the postings of a term table entry.
+        '''
+        start = self.postings_offset + entry[3]
+        return decode_postings(self.data, start, start + entry[4])
+
+    def __contains__(self, term):
+        return self.find(term) is not None
+
+    def __getitem__(self, term):
+        entry = self.find(term)
+        if entry is None:
+            raise KeyError(term)
+        return [entry[2], self.postings(entry)]
+
+    def get(self, term, default = None):
+        entry = self.find(term)
+        if entry is None:
+            return default
+        return [entry[2], self.postings(entry)]
+
+    def __len__(self):
+        return self.num_terms
+
+    def __iter__(self):
+        for position in range(self.num_terms):
+            yield self.term(self.entry(position)).decode('utf-8')
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection name
+    sys.argv[2] -> lemmatization (l) or stemming (s)
+    eg. python3 ./code/binary_index.py CISI_simplified l
+    '''
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 3:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[2] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    # converting the existing json index into the binary format.
+    json_file = './processed/' + sys.argv[1] + '_' + sys.argv[2] + '.json'
+    if not exists(json_file):
+        print("- Error: File Doesn't Exist. -")
+        sys.exit(1)
+
+    file = open(json_file)
+    index = json.load(file)
+    file.close()
+
+    write_binary_index(sys.argv[1], index, sys.argv[2])
+
+    print("SUCCESS")
+    exit(0)
@@ -7,16 +7,29 @@ The program will be run from the root of the repository.
 
 '''
 
+import os
 import sys
 import json
+import math
+import bisect
+import functools
+import itertools
+import multiprocessing
 from os.path import exists
 from preprocessing import tokenize
 from preprocessing import normalize
+from preprocessing import save_vocabulary
+from preprocessing import download_resources
+from preprocessing import caches
+from index_reader import write_term_table
+from binary_index import write_binary_index
+import utils
 
 
-def read_documents(collection):
+def iter_documents(collection):
     '''
-    Reads the documents in the collection (inside the 'collections' folder).
+    Streams the documents in the collection (inside the 'collections'
+    folder), yielding (docID, text) one document at a time.
     '''
 
     assert type(collection) == str
@@ -26,111 +39,405 @@ def read_documents(collection):
     if not exists(corpus_file):
         print("- Error: File Doesn't Exist. -")
         sys.exit(1)
-    
-    documents = {}
 
-    # opening the file.
+    # only the docIDs are kept, to detect duplicates.
+    seen = set()
+    key = None
+    text = []
+    reading = False
+
+    # opening the file, and reading it line by line.
     file = open(corpus_file, 'r')
-    lines = file.readlines()
-    key = 0
 
-    # for loop to retrieve all documents and docID's
-    for index in range(len(lines)):
+    for line in file:
+        marker = line[0:2]
 
-        # checking if it is index.
-        if lines[index][0:2] == '.I':
-            key = int(lines[index].split()[1])
+        # the text (abstract) runs from a '.W' line until we encounter one
+        # of the five possible states.
+        if marker in ['.I', '.T', '.A', '.W', '.X']:
+            reading = False
 
-            # checking if the key already exists within the documents dictionary.
-            if key in documents.keys():
+        # checking if it is index, which ends the previous document.
+        if marker == '.I':
+            if key is not None:
+                yield key, check_text(key, text)
+
+            key = int(line.split()[1])
+
+            # checking if the key has already been read.
+            if key in seen:
                 print("- Error: Key Already In Documents -")
                 sys.exit(1)
-
-            # setting the documents key: value pair.
-            documents[key] = ''
+            seen.add(key)
+            text = []
 
         # checking if it is text (abstract).
-        if lines[index][0:2] == '.W':
-            temp = index + 1
-
-            # adding text to the string until we encounter one of the five possible states.
-            while temp < len(lines) and lines[temp][0:2] not in ['.I', '.T', '.A', '.W', '.X']:
-                documents[key] += lines[temp]
-                temp += 1
-
-    # checking for missing values.
-    for key in documents.keys():
-        if documents[key] == '':
-            print("- Error: Value Doesn't Exist For ID = " + str(key) + " - ")
-            sys.exit(1)
+        elif marker == '.W':
+            reading = True
+
+        elif reading:
+            text.append(line)
+
+    if key is not None:
+        yield key, check_text(key, text)
 
     # closing the file
-    file.close()    
+    file.close()
+
+    print(f'{len(seen)} documents read in total')
+
+def check_text(key, text):
+    '''
+    Joins the lines of a document's text, checking for a missing value.
+    '''
+    text = ''.join(text)
+
+    if text == '':
+        print("- Error: Value Doesn't Exist For ID = " + str(key) + " - ")
+        sys.exit(1)
+
+    return text
 
-    print(f'{len(documents)} documents read in total')
-    return documents
+def read_documents(collection):
+    '''
+    Reads all documents in the collection (inside the 'collections' folder)
+    into memory.
+    '''
+    return dict(iter_documents(collection))
 
 def build_index(documents, s):
     '''
-    Builds inverted index.
+    Builds inverted index, from a dictionary of docID -> text or an
+    iterable of (docID, text) such as iter_documents.
     '''
 
-    assert type(documents) == dict
+    # normalizing each document's text in preprocessing using a stemmer
+    # (s) or a lemmatizer (l), and building the index of the method.
+    return build_indexes(documents, [s])[s]
 
-    index = {} 
-    tokenized = {}
-    
-    # normalizing each document's text in preprocessing using a stemmer, 
-    # and storing the result in tokenized.
-    if s == 'l':
-        method = 'lemmatization'
-    else:
-        method = 'stemming'
-    
-    for docID in documents:
-        original_text = documents[docID]
-        tokenized[docID] = normalize(tokenize(original_text), method)
+def normalize_chunk(chunk, methods):
+    '''
+    Tokenizes every document of a chunk once, and normalizes the tokens
+    with each of the methods. Returns the normalized documents, with the
+    surface form -> normalized terms seen in the chunk.
+    '''
+    normalized = []
+    vocabulary = {}
+
+    for docID, original_text in chunk:
+        tokens = tokenize(original_text)
+        terms = [normalize(tokens, method) for method in methods]
+        normalized.append((docID, terms))
+
+        for position, token in enumerate(tokens):
+            vocabulary[token.lower()] = [method_terms[position] for method_terms in terms]
+
+    return normalized, vocabulary
+
+def chunked(records, chunk_size):
+    '''
+    Groups an iterable of records into lists of up to chunk_size records,
+    without reading ahead.
+    '''
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def normalize_chunks(chunks, names, pool, workers):
+    '''
+    Normalizes the chunks in order, a few chunks per worker at a time, so
+    only a bounded amount of text is held in memory.
+    '''
+    if pool is None:
+        for chunk in chunks:
+            yield normalize_chunk(chunk, names)
+        return
+
+    while True:
+        batch = list(itertools.islice(chunks, workers * 2))
+        if not batch:
+            return
+        yield from pool.map(functools.partial(normalize_chunk, methods = names), batch)
+
+def build_indexes(documents, methods, workers = 1, chunk_size = 64):
+    '''
+    Builds an inverted index per method ('l' or 's') in a single
+    tokenization pass, normalizing chunks of documents over a pool of
+    worker processes. The documents are a dictionary of docID -> text or
+    an iterable of (docID, text) such as iter_documents.
+    '''
+
+    names = ['lemmatization' if method == 'l' else 'stemming' for method in methods]
+    postings = {method: {} for method in methods}
+
+    if type(documents) == dict:
+        documents = documents.items()
+    chunks = chunked(documents, chunk_size)
+
+    # the chunks come back in order, so the postings stay in the order
+    # the documents were read.
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    results = normalize_chunks(chunks, names, pool, workers)
+
+    # every chunk is added to the postings as it comes back and then
+    # dropped, so the normalized collection is never held in memory.
+    for normalized, vocabulary in results:
+        for docID, terms in normalized:
+            for method, method_terms in zip(methods, terms):
+                add_postings(postings[method], docID, method_terms)
+
+        # the workers' caches are lost with them, so the vocabulary they
+        # saw is copied into this process' caches for write_vocabulary.
+        if pool is not None:
+            for token, method_terms in vocabulary.items():
+                for name, term in zip(names, method_terms):
+                    caches[name].put(token, term)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     # Building the inverted index, with the number of documents (raw DF) in
     # index 0, and in index 1, we store the docID, the number of times it 
-    # appears in the document, and the positions in the documents.
-        
-    for docID in documents:
-        for temp in range(len(tokenized[docID])):
-
-            # adding word as a key to the index, if not already in the index.
-            if str(tokenized[docID][temp]) not in index:
-                index[str(tokenized[docID][temp])] = [0, []]
-                index[str(tokenized[docID][temp])][1].append([docID, 1, [temp + 1]])
-
-            # otherwise, it's not our first encounter with the word, so we 
-            # update the postings accordingly.
-                
-            else:
-                # getting all the docID's referenced by the word.
-                docIDs = [item[0] for item in index[str(tokenized[docID][temp])][1]]
-
-                # if we already have the document listed, we update the counter (df) and
-                # add the new position of the word.
-
-                if docID in docIDs:
-                    for item in index[str(tokenized[docID][temp])][1]:
-                        if item[0] == docID:
-                            item[1] += 1
-                            item[2].append(temp + 1)
-                
-                # if the docID doesn't exist, we add a new set of attributes to 
-                # the term.
+    # appears in the document, and the positions in the documents, then
+    # sorting the index based on the terms.
+    indexes = {}
+    for method in methods:
+        index = emit_postings(postings.pop(method))
+        indexes[method] = dict(sorted(index.items()))
+
+    return indexes
+
+def add_postings(postings, docID, terms):
+    '''
+    Adds the terms of one normalized document to the postings being
+    accumulated, as term -> docID -> positions.
+    '''
+
+    # recording the (1-based) position of every occurrence under its term
+    # and document, in the order the documents are read.
+    for position, term in enumerate(terms, 1):
+        term = str(term)
+
+        if term not in postings:
+            postings[term] = {}
+        documents = postings[term]
+
+        if docID not in documents:
+            documents[docID] = []
+        documents[docID].append(position)
+
+def emit_postings(postings):
+    '''
+    Turns accumulated postings into the index, in its usual
+    [df, [[docID, tf, [positions]]]] form, with the postings of every term
+    sorted by docID.
+    '''
+    # a collection doesn't have to list its documents in docID order, but
+    # the gap encoding, MaxScore and the intersections rely on it.
+    index = {}
+    for term, documents in postings.items():
+        index[term] = [len(documents), [[docID, len(documents[docID]), documents[docID]] for docID in sorted(documents)]]
+
+    return index
+
+def accumulate_postings(tokenized):
+    '''
+    Accumulates the postings of every term in a single pass over a
+    dictionary of docID -> normalized terms.
+    '''
+    postings = {}
+    for docID in tokenized:
+        add_postings(postings, docID, tokenized[docID])
+    return emit_postings(postings)
+
+def build_statistics(index):
+    '''
+    Builds the document statistics table: the number of documents N,
+    the average document length, and for every document its length and
+    the L2 norm of its full vector under each tf/idf weighting.
+    '''
+
+    assert type(index) == dict
+
+    # the length of every document is the sum of its term frequencies.
+    lengths = {}
+    for term in index:
+        for doc_details in index[term][1]:
+            if doc_details[0] not in lengths:
+                lengths[doc_details[0]] = 0
+            lengths[doc_details[0]] += doc_details[1]
+
+    total_size = len(lengths)
+    squares = {docID: {weighting: 0 for weighting in utils.weightings} for docID in lengths}
+
+    # summing the squared weight of every posting under each weighting,
+    # once N is known for the idf.
+    for term in index:
+        raw_freq = index[term][0]
+        for doc_details in index[term][1]:
+            for weighting in utils.weightings:
+                weight = utils.tf_compute(weighting[0], doc_details[1]) * utils.df_compute(weighting[1], total_size, raw_freq)
+                squares[doc_details[0]][weighting] += weight * weight
+
+    documents = {}
+    for docID in sorted(lengths):
+        norms = {weighting: math.sqrt(squares[docID][weighting]) for weighting in utils.weightings}
+        documents[docID] = {'length': lengths[docID], 'norms': norms}
+
+    statistics = {
+        'N': total_size,
+        'average_length': sum(lengths.values()) / total_size if total_size > 0 else 0,
+        'documents': documents
+    }
+    return statistics
+
+def build_bounds(index, statistics):
+    '''
+    Builds the maximum impact bound of every term: for each tf/idf
+    weighting, the largest weight of any of its postings.
+    '''
+
+    assert type(index) == dict
+
+    total_size = statistics['N']
+    bounds = {}
+
+    for term in index:
+        raw_freq = index[term][0]
+        bounds[term] = {}
+
+        for weighting in utils.bounded_weightings:
+            idf = utils.df_compute(weighting[1], total_size, raw_freq)
+            largest = 0
+
+            # the weights are computed exactly as they are at query time,
+            # so the bound is never below the weight of a posting.
+            for doc_details in index[term][1]:
+                if weighting[0] == 'b':
+                    length = statistics['documents'][doc_details[0]]['length']
+                    weight = utils.bm25_compute(doc_details[1], length, statistics['average_length']) * idf
                 else:
-                    index[str(tokenized[docID][temp])][1].append([docID, 1, [temp + 1]])
+                    weight = utils.tf_compute(weighting[0], doc_details[1]) * idf
+                largest = max(largest, weight)
+
+            bounds[term][weighting] = largest
+
+    return bounds
+
+def write_bounds(collection, bounds, method):
+    '''
+    Writes the term bounds to the processed folder.
+    '''
+
+    assert type(bounds) == dict
+    bounds_file = './processed/' + collection + '_' + method + '_bounds.json'
+
+    # the bounds of a previous build are replaced along with its index.
+
+    file = open(bounds_file, 'w')
+    json.dump(bounds, file)
+    file.close()
+
+def write_vocabulary(collection, method):
+    '''
+    Writes the surface form -> normalized term table of the method to
+    the processed folder, so query processes start with a warm cache.
+    '''
+    vocabulary_file = './processed/' + collection + '_' + method + '_vocab.json'
+
+    # a table of a previous build is overwritten, like the term table.
+
+    if method == 'l':
+        save_vocabulary(vocabulary_file, 'lemmatization')
+    else:
+        save_vocabulary(vocabulary_file, 'stemming')
+
+def write_statistics(collection, statistics, method):
+    '''
+    Writes the document statistics table to the processed folder.
+    '''
+
+    assert type(statistics) == dict
+    statistics_file = './processed/' + collection + '_' + method + '_stats.json'
+
+    # derived from the index, so it is rewritten whenever the index is.
+
+    file = open(statistics_file, 'w')
+    json.dump(statistics, file)
+    file.close()
+
+def split_index(index, statistics, shards):
+    '''
+    Splits an index into document-range shards, returning a list of
+    (index, statistics) per shard with the manifest. Every shard keeps the
+    global df of its terms, and its statistics table the global N and
+    average length, so a shard scores its documents exactly as the full
+    index does.
+    '''
+
+    assert type(index) == dict
+
+    # cutting the sorted docIDs into ranges of (almost) equal size.
+    docIDs = sorted(statistics['documents'])
+    size = math.ceil(len(docIDs) / shards)
+    starts = docIDs[::size]
+
+    split = []
+    manifest = {'N': statistics['N'], 'shards': []}
+    for shard, start in enumerate(starts):
+        members = docIDs[shard * size:(shard + 1) * size]
+        documents = {docID: statistics['documents'][docID] for docID in members}
+        split.append(({}, {'N': statistics['N'], 'average_length': statistics['average_length'], 'documents': documents}))
+        manifest['shards'].append({'first': members[0], 'last': members[-1], 'documents': len(members)})
 
-    # updating the raw DF in index 0 of the term.
     for term in index:
-        index[term][0] = len(index[term][1])
-    
-    # sorting the index based on the terms and returning it.
-    index = dict(sorted(index.items()))
-    return index
+        raw_freq = index[term][0]
+        for doc_details in index[term][1]:
+            shard_index = split[bisect.bisect_right(starts, doc_details[0]) - 1][0]
+            if term not in shard_index:
+                shard_index[term] = [raw_freq, []]
+            shard_index[term][1].append(doc_details)
+
+    return split, manifest
+
+def write_shards(collection, split, manifest, method):
+    '''
+    Writes every shard's index and statistics table, with the manifest,
+    to the processed folder.
+    '''
+    prefix = './processed/' + collection + '_' + method + '_shard'
+
+    # checks if it is a valid file.
+    if exists(prefix + 's.json'):
+        print("- Error: Processed File Already Exists. -")
+        sys.exit(1)
+
+    for shard, (index, statistics) in enumerate(split):
+        for data, suffix in [(index, '.json'), (statistics, '_stats.json')]:
+            file = open(prefix + str(shard) + suffix, 'w')
+            json.dump(data, file)
+            file.close()
+
+    file = open(prefix + 's.json', 'w')
+    json.dump(manifest, file)
+    file.close()
+
+def check_outputs(collection, methods, shards):
+    '''
+    Exits before anything is written if an index (or shard manifest) of
+    any method already exists, so a failed build never leaves some
+    methods rebuilt and others not. The files derived from an index are
+    rewritten with it.
+    '''
+    for method in methods:
+        prefix = './processed/' + collection + '_' + method
+        if exists(prefix + '.json') or (shards > 1 and exists(prefix + '_shards.json')):
+            print("- Error: Processed File Already Exists. -")
+            sys.exit(1)
 
 def write_index(collection, index, method):
     '''
@@ -169,24 +476,65 @@ if __name__ == "__main__":
     '''
     main() function
     sys.argv[1] -> collection name
+    sys.argv[2] -> number of worker processes (optional, defaults to 1)
+    --shards=N  -> also splits both indexes into N document-range shards
     '''
 
+    # the number of shards is given as a flag, so it is read first.
+    shards = 1
+    for argument in sys.argv[1:]:
+        if argument.startswith('--shards='):
+            if not argument[9:].isdigit() or int(argument[9:]) <= 0:
+                print("- Error: Invalid Number of Shards. - ")
+                sys.exit(1)
+            shards = int(argument[9:])
+    sys.argv = [argument for argument in sys.argv if not argument.startswith('--')]
+
     # read the collection name from command line
     n = len(sys.argv)
 
     # Checking if correct number of command line arguements are provided
-    if n != 2:
+    if n not in [2, 3]:
         print("- Error: Incorrect Number of Arguments -")
         sys.exit(1)
+
+    workers = 1
+    if n == 3:
+        if not sys.argv[2].isdigit() or int(sys.argv[2]) <= 0:
+            print("- Error: Invalid Number of Workers. - ")
+            sys.exit(1)
+        workers = int(sys.argv[2])
     
-    # reading all documents, creating the index and writing it into a json file.
-    documents = read_documents(sys.argv[1])
-    method = 'l'
-    index = build_index(documents, method)
-    write_index(sys.argv[1], index, method)
-    method = 's'
-    index = build_index(documents, method)
-    write_index(sys.argv[1], index, method)
+    # checking every output before the (long) build.
+    check_outputs(sys.argv[1], ['l', 's'], shards)
+
+    # fetching any NLTK data that isn't available locally yet; queries
+    # never download.
+    download_resources()
+
+    # streaming all documents, creating both indexes in a single pass and
+    # writing them into json files.
+    indexes = build_indexes(iter_documents(sys.argv[1]), ['l', 's'], workers)
+
+    for method in ['l', 's']:
+        index = indexes[method]
+        write_index(sys.argv[1], index, method)
+        write_term_table(sys.argv[1], method)
+        statistics = build_statistics(index)
+        write_statistics(sys.argv[1], statistics, method)
+        write_bounds(sys.argv[1], build_bounds(index, statistics), method)
+        write_vocabulary(sys.argv[1], method)
+
+        # query.py reads the binary index instead of the json index when
+        # it exists, so a binary index of the previous build is rebuilt.
+        binary_file = './processed/' + sys.argv[1] + '_' + method + '.idx'
+        if exists(binary_file):
+            os.remove(binary_file)
+            write_binary_index(sys.argv[1], index, method)
+
+        if shards > 1:
+            split, manifest = split_index(index, statistics, shards)
+            write_shards(sys.argv[1], split, manifest, method)
     
     # prints success if everything has been executed properly.
     print("SUCCESS")
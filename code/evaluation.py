@@ -7,8 +7,15 @@ and ranks the retrieval based on the actual documents to be retrieved
 '''
 
 import sys
+import math
 import subprocess
 import random
+import multiprocessing
+import json
+import query
+import result_cache
+import profiler
+import topk
 
 # finding the ranking of the first relevant document returned for query
 def calculate_rank(relevant_docs, retrieved_docs):
@@ -26,7 +33,7 @@ def mrr(relevant, retrieved):
     # calculating rank for each query
     for query_id in relevant.keys():
 
-        relevant_docs = relevant[query_id]
+        relevant_docs = set(relevant[query_id])
         retrieved_docs = retrieved[query_id]
 
         # ranking of the first relevant document returned for query
@@ -74,7 +81,7 @@ def map_k(relevant, retrieved, r):
     
     # going through each query in the relevant keys.
     for query_id in relevant.keys():
-        relevant_docs = relevant[query_id]
+        relevant_docs = set(relevant[query_id])
         retrieved_docs = retrieved[query_id]
 
         # finding the average precision through compute_relevant_documents, which
@@ -86,10 +93,137 @@ def map_k(relevant, retrieved, r):
     
     return mean_average_precision
 
-def evaluation(program, collection, scheme, method, k, r, metric):
+# the metrics computed by the metrics engine at every cut-off.
+METRICS = ['mrr', 'map', 'precision', 'recall', 'ndcg']
+
+def cumulative_metrics(relevant_docs, docIDs, start = None):
+    '''
+    Walks a ranked list of docIDs once, and returns the running number of
+    relevant documents, sum of precisions at the relevant documents and
+    discounted cumulative gain after every position, with the rank of the
+    first relevant document (0 if there is none). A start continues the
+    running values of a longer list from its last position.
+    '''
+    hits, precision, gain, first = start if start is not None else ([0], [0], [0], 0)
+    hits, precision, gain = hits[:], precision[:], gain[:]
+
+    for docID in docIDs:
+        position = len(hits)
+        if docID in relevant_docs:
+            hits.append(hits[-1] + 1)
+            precision.append(precision[-1] + hits[-1] / position)
+            gain.append(gain[-1] + 1 / math.log2(position + 1))
+            if first == 0:
+                first = position
+        else:
+            hits.append(hits[-1])
+            precision.append(precision[-1])
+            gain.append(gain[-1])
+
+    return hits, precision, gain, first
+
+def split_tie(ranking, k):
+    '''
+    Returns where the tie group cut by the first k documents of a ranking
+    starts, and the documents of the group query.py returns for k (or
+    None if k falls between two groups). Ties are ordered differently
+    when a group is cut, so the top-k list isn't always the first k
+    documents of a deeper ranking.
+    '''
+    if k >= len(ranking) or ranking[k][0] != ranking[k - 1][0]:
+        return k, None
+
+    start = k - 1
+    while start > 0 and ranking[start - 1][0] == ranking[k - 1][0]:
+        start -= 1
+
+    # the group is selected and ordered by topk, as cutoff does.
+    group = [item for item in ranking[start:] if item[0] == ranking[k - 1][0]]
+    selected = topk.select(((docID, score) for score, docID in group), k - start)
+
+    # order() only treats the first group of a ranking specially; any
+    # other group is listed by increasing docID.
+    if start > 0:
+        selected = sorted(selected, key = lambda item: item[1])
+    return start, [docID for score, docID in selected]
+
+def query_metrics(relevant_docs, ranking, cutoffs):
+    '''
+    Computes every metric of one query at every cut-off, from its deepest
+    ranking of (score, docID) pairs, in one pass over the ranking.
+    Returns a dictionary of k -> metric -> value.
+    MRR and MAP follow mrr and map_k: the reciprocal rank of the first
+    relevant document, and the average precision over the relevant
+    documents retrieved. nDCG uses binary gains.
+    '''
+    relevant_docs = set(relevant_docs)
+    docIDs = [docID for score, docID in ranking]
+    running = cumulative_metrics(relevant_docs, docIDs)
+
+    metrics = {}
+    for k in cutoffs:
+        start, group = split_tie(ranking, k)
+        hits, precision, gain, first = running
+        if group is not None:
+            # continuing from the documents before the cut group.
+            prefix = (hits[:start + 1], precision[:start + 1], gain[:start + 1], first if 0 < first <= start else 0)
+            hits, precision, gain, first = cumulative_metrics(relevant_docs, group, prefix)
+
+        depth = min(k, len(hits) - 1)
+        ideal = sum(1 / math.log2(position + 1) for position in range(1, min(len(relevant_docs), k) + 1))
+
+        metrics[k] = {
+            'mrr': 1 / first if 0 < first <= depth else 0,
+            'map': precision[depth] / hits[depth] if hits[depth] != 0 else 0,
+            'precision': hits[depth] / k,
+            'recall': hits[depth] / len(relevant_docs) if relevant_docs else 0,
+            'ndcg': gain[depth] / ideal if ideal != 0 else 0
+        }
+
+    return metrics
+
+def evaluate_rankings(relevant, rankings, cutoffs):
+    '''
+    Computes the per-query breakdown of every metric at every cut-off for
+    the ranked queries with relevance judgments. Returns a dictionary of
+    query ID -> k -> metric -> value.
+    '''
+    return {query_id: query_metrics(relevant[query_id], rankings[query_id], cutoffs) for query_id in relevant if query_id in rankings}
+
+def mean_metrics(per_query, query_ids = None, r = None):
+    '''
+    Averages a per-query breakdown over the given queries (all of them by
+    default), returning a dictionary of k -> metric -> value. As in
+    map_k, MAP is divided by r, the number of queries sampled, when it is
+    given.
+    '''
+    if query_ids is None:
+        query_ids = list(per_query)
+    selected = set(query_ids)
+    query_ids = [query_id for query_id in per_query if query_id in selected]
+    if not query_ids:
+        return {}
+
+    means = {}
+    for k in per_query[query_ids[0]]:
+        means[k] = {}
+        for metric in METRICS:
+            divisor = r if metric == 'map' and r is not None else len(query_ids)
+
+            # dividing before adding, as map_k does.
+            if metric == 'map':
+                means[k][metric] = sum(per_query[query_id][k][metric] / divisor for query_id in query_ids)
+            else:
+                means[k][metric] = sum(per_query[query_id][k][metric] for query_id in query_ids) / divisor
+    return means
+
+def read_queries(collection):
+    '''
+    Reads the queries in the collection's .QRY file into a dictionary
+    of query ID -> query text.
+    '''
 
     file = open('./collections/' + collection + '.QRY', 'r')
-    file1 = open('./collections/' + collection + '.REL', 'r')
 
     # initializing terms required for reading 10 queries from the CISI_simplified.QRY
     qry, qry_count, current_query_id, current_query_text = {}, 0, None, ""
@@ -124,17 +258,55 @@ def evaluation(program, collection, scheme, method, k, r, metric):
     if current_query_id is not None and current_query_text != "":
         qry[current_query_id] = current_query_text.strip()
 
-    # picking r queries at random from the collection
-    random_queries = random.choices(sorted(qry), k = r)
+    file.close()
+    return qry
+
+def read_relevance(collection, query_ids = None):
+    '''
+    Reads the collection's .REL file into a dictionary of query ID ->
+    list of relevant docIDs, keeping only the given query IDs if any.
+    '''
+
+    file1 = open('./collections/' + collection + '.REL', 'r')
+
+    # initialize a dictionary to store relevance information
+    relevant = {}
+    for line in file1.readlines():
+        line = line.split()  
+        # initialize an empty list for the query ID if not present in the dictionary
+
+        if query_ids is not None and line[0] not in query_ids:
+            continue
+
+        if line[0] not in relevant.keys():
+            relevant[line[0]] = [] 
+        relevant[line[0]].append(int(line[1]))   # append the relevant document ID to the list corresponding to the query ID
+
+    file1.close()
+    return relevant
+
+def retrieve_subprocess(program, collection, scheme, method, k, queries):
+    '''
+    Runs query.py once per query and parses the docIDs from its output,
+    treating it as a black box.
+    '''
 
     # initialize a dictionary to store retrieved information
     retrieved = {}
-    for i in random_queries: 
+    for i in queries: 
         answers = []
         # python3 ./code/query.py CISI_simplified ltn l 10 keyword
-        output = subprocess.check_output(["python3", program, collection, scheme, method, str(k), qry[i]])
+        command = ["python3", program, collection, scheme, method, str(k), queries[i]]
+        if profiler.enabled:
+            command.append('--profile')
+        output = subprocess.check_output(command)
         output = output.decode('utf-8').strip()
 
+        # the profile is the last line of the output.
+        if profiler.enabled:
+            output, profile = output.rsplit('\n', 1)
+            profiles.append(json.loads(profile))
+
         # appending all the docIDs returned by output into a list
         output_lines = output.split('\n')
         for line in output_lines:
@@ -144,18 +316,74 @@ def evaluation(program, collection, scheme, method, k, r, metric):
 
         retrieved[i] = answers
 
-    # initialize a dictionary to store relevance information
-    relevant = {}
-    for line in file1.readlines():
-        line = line.split()  
-        # initialize an empty list for the query ID if not present in the dictionary
+    return retrieved
 
-        if line[0] not in retrieved.keys():
-            continue
+def load_worker_index(collection, method, profile = False):
+    '''
+    Initializes a pool worker by loading the index once.
+    '''
+    if profile:
+        profiler.enable()
+    query.index = query.read_index(collection, method)
+    query.statistics = query.read_statistics(collection, method)
 
-        if line[0] not in relevant.keys():
-            relevant[line[0]] = [] 
-        relevant[line[0]].append(int(line[1]))   # append the relevant document ID to the list corresponding to the query ID
+def answer_query(arguments):
+    '''
+    Scores one query with the index loaded in this process, and returns
+    the query ID with the ranked docIDs. Queries scored again in the same
+    process (for another k, metric or sample) are answered from the
+    result cache.
+    '''
+    query_id, collection, keyword_query, scheme, method, k = arguments
+    answer = result_cache.results.answer(collection, keyword_query, scheme, k, method, query.index, query.statistics)
+
+    # the first query of a process also holds the time spent loading.
+    profile = None
+    if profiler.enabled:
+        profile = profiler.snapshot()
+        profiler.reset()
+
+    return query_id, [docID for score, docID in answer], profile
+
+def retrieve_in_process(collection, scheme, method, k, queries, workers = 1):
+    '''
+    Loads the index once and scores the queries by calling the scoring
+    function directly, optionally over a pool of worker processes.
+    '''
+    arguments = [(i, collection, queries[i], scheme, method, k) for i in queries]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, load_worker_index, (collection, method, profiler.enabled))
+        results = pool.map(answer_query, arguments)
+        pool.close()
+        pool.join()
+    else:
+        load_worker_index(collection, method)
+        results = [answer_query(argument) for argument in arguments]
+
+    profiles.extend(profile for query_id, answer, profile in results if profile is not None)
+    return {query_id: answer for query_id, answer, profile in results}
+
+# the profile of every query scored, with --profile.
+profiles = []
+
+def evaluation(program, collection, scheme, method, k, r, metric, black_box = False, workers = 1):
+
+    # reading the queries of the collection.
+    qry = read_queries(collection)
+
+    # picking r queries at random from the collection
+    random_queries = random.choices(sorted(qry), k = r)
+    queries = {i: qry[i] for i in random_queries}
+
+    # the subprocess mode runs query.py once per query, otherwise the
+    # queries are scored in this process (or a pool of workers).
+    if black_box:
+        retrieved = retrieve_subprocess(program, collection, scheme, method, k, queries)
+    else:
+        retrieved = retrieve_in_process(collection, scheme, method, k, queries, workers)
+
+    relevant = read_relevance(collection, retrieved.keys())
 
     if metric == 'mrr':
         result = mrr(relevant, retrieved)
@@ -174,8 +402,25 @@ if __name__ == "__main__":
     sys.argv[4] -> number of documents wanted (k)
     sys.argv[5] -> number of random queries
     sys.argv[6] -> metric (MRR or MAP@k)
+    --subprocess -> run query.py once per query instead of in-process
+    --workers=N -> score the queries over N worker processes
+    --profile -> prints the distribution of each stage's time and
+                 counters over the queries as JSON
     eg. % python3 ./code/evaluation.py CISI_simplified ltn l 10 100 mrr
     '''
+    # removing the optional flags before checking the arguments.
+    black_box = '--subprocess' in sys.argv
+    if '--profile' in sys.argv:
+        profiler.enable()
+    workers = 1
+    for argument in sys.argv[1:]:
+        if argument.startswith('--workers='):
+            if not argument[10:].isdigit() or int(argument[10:]) <= 0:
+                print("- Error: Invalid Number of Workers. - ")
+                sys.exit(1)
+            workers = int(argument[10:])
+    sys.argv = [argument for argument in sys.argv if not argument.startswith('--')]
+
     # read the collection name from command line
     n = len(sys.argv)
 
@@ -192,8 +437,8 @@ if __name__ == "__main__":
     # setting our scheme to all lowercase.
     sys.argv[2] = sys.argv[2].lower()
 
-    # checking if tf scheme is one of ['l','n'].
-    if sys.argv[2][0] not in ['l','n']:
+    # checking if tf scheme is one of ['l','n','b'].
+    if sys.argv[2][0] not in ['l','n','b']:
         print("- Error: Incorrect 'tf' Input. -")
         sys.exit(1)
 
@@ -202,10 +447,15 @@ if __name__ == "__main__":
         print("- Error: Incorrect 'idf' Input. -")
         sys.exit(1)
 
-    # checking if normalization scheme is one of ['c','n'].
-    if sys.argv[2][2] not in ['c','n']:
+    # checking if normalization scheme is one of ['c','n','f'].
+    if sys.argv[2][2] not in ['c','n','f']:
         print("- Error: Incorrect 'Normalization' Input. -")
         sys.exit(1)
+
+    # the full-vector norms are only stored for the 'l' and 'n' tf.
+    if sys.argv[2][0] == 'b' and sys.argv[2][2] == 'f':
+        print("- Error: Full-Vector Cosine Is Not Available For BM25. -")
+        sys.exit(1)
     
     # checking if we can convert our string(k) into int(k).
     try:
@@ -230,7 +480,10 @@ if __name__ == "__main__":
         print("- Error: Invalid Metric Input. - ")
 
     program = "./code/query.py"
-    result = evaluation(program,sys.argv[1],sys.argv[2],sys.argv[3],k,int(sys.argv[5]),sys.argv[6])
+    result = evaluation(program,sys.argv[1],sys.argv[2],sys.argv[3],k,int(sys.argv[5]),sys.argv[6],black_box,workers)
     print('Program : ',sys.argv[0], ', Collection : ', sys.argv[1], ', Scheme : ', sys.argv[2], ', Method : ', sys.argv[3], ', K : ', sys.argv[4], ', Random : ', sys.argv[5], ', Metric : ', sys.argv[6], ' = ', str(result))
 
+    if profiler.enabled:
+        print(json.dumps(profiler.aggregate(profiles)))
+
     exit(0)
\ No newline at end of file
@@ -0,0 +1,276 @@
+'''
+
+Impact-ordered index with quantized, precomputed weights.
+
+For one (tf, idf, normalization) scheme, the weight of every posting is
+computed once, divided by the document norm for full-vector cosine (f),
+and quantized to an integer impact of a few bits. The postings of a
+term are grouped by impact, highest first. A query is then scored
+score-at-a-time: the groups of all query terms are processed in
+decreasing order of their contribution (query weight * impact), with
+integer additions only, and scoring stops early once the remaining
+groups can no longer change the top-k.
+
+Cosine normalization over the query terms (c) depends on the query, so
+it can't be precomputed; BM25 and 'l'/'n' tf with 'n' or 'f'
+normalization are supported.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import time
+import heapq
+import bisect
+from os.path import exists
+import query
+import utils
+import topk
+import result_cache
+from evaluation import read_queries
+from evaluation import read_relevance
+from evaluation import mrr
+from evaluation import map_k
+
+def impact_file(collection, method, scheme, bits):
+    return './processed/' + collection + '_' + method + '_' + scheme + '_impact' + str(bits) + '.json'
+
+def build_impact_index(index, statistics, scheme, bits):
+    '''
+    Computes the weight of every posting for the scheme, and quantizes it
+    uniformly to 'bits' bits. Returns the scale (weight per impact unit)
+    and, for every term, its [impact, [docIDs]] groups by decreasing
+    impact.
+    '''
+    tf_scheme, df_scheme, normalization = scheme
+    total_size = utils.number_of_documents(index, statistics)
+
+    weights = {}
+    largest = 0
+    for term in index:
+        raw_freq, postings = index[term]
+        weights[term] = []
+        for doc_details in postings:
+            weight = query.posting_weight(tf_scheme, df_scheme, doc_details, total_size, raw_freq, statistics)
+            if normalization == 'f':
+                weight = weight / statistics['documents'][doc_details[0]]['norms'][tf_scheme + df_scheme]
+            weights[term].append((doc_details[0], weight))
+            largest = max(largest, weight)
+
+    levels = 2 ** bits - 1
+    scale = largest / levels if largest > 0 else 1
+
+    terms = {}
+    for term in weights:
+        groups = {}
+        for docID, weight in weights[term]:
+            impact = round(weight / scale)
+
+            # a posting rounded to 0 adds nothing, but still makes its
+            # document a candidate, as in exhaustive scoring.
+            groups.setdefault(impact, []).append(docID)
+        terms[term] = [[impact, sorted(groups[impact])] for impact in sorted(groups, reverse = True)]
+
+    return {'scheme': scheme, 'bits': bits, 'scale': scale, 'N': total_size, 'terms': terms}
+
+def write_impact_index(collection, method, impact_index):
+    file = open(impact_file(collection, method, impact_index['scheme'], impact_index['bits']), 'w')
+    json.dump(impact_index, file)
+    file.close()
+
+def load_impact_index(collection, method, scheme, bits, index = None, statistics = None):
+    '''
+    Loads the impact index of a scheme from the processed folder,
+    building and writing it first if it doesn't exist or the index
+    changed since (its files' signature is stored with it).
+    '''
+    path = impact_file(collection, method, scheme, bits)
+
+    # json turns the signature's tuples into lists.
+    source = json.loads(json.dumps(result_cache.index_signature(collection, method)))
+
+    if exists(path):
+        file = open(path)
+        impact_index = json.load(file)
+        file.close()
+        if impact_index.get('source') == source:
+            return impact_index
+
+    if index is None:
+        index = query.read_index(collection, method)
+        statistics = query.read_statistics(collection, method)
+    impact_index = build_impact_index(index, statistics, scheme, bits)
+    impact_index['source'] = source
+    write_impact_index(collection, method, impact_index)
+    return impact_index
+
+def top_two_gap(accumulators, k):
+    '''
+    Returns the k-th largest accumulator and the (k + 1)-th (0 if there
+    are only k).
+    '''
+    largest = heapq.nlargest(k + 1, accumulators.values())
+    return largest[k - 1], largest[k] if len(largest) > k else 0
+
+def score_at_a_time(query_vector, impact_index, k, early_termination = True):
+    '''
+    Scores the impact groups of the query terms in decreasing order of
+    contribution, and returns a dictionary of docID -> integer score with
+    the number of postings processed. With early termination, scoring
+    stops once no remaining group can change which documents are in the
+    top-k; the scores of the top-k are then completed from the remaining
+    groups.
+    '''
+    terms = impact_index['terms']
+
+    # every group of every query term, by decreasing contribution.
+    groups = []
+    for token, query_weight in query_vector.items():
+        if token in terms:
+            for position, (impact, docIDs) in enumerate(terms[token]):
+                groups.append((query_weight * impact, token, position, docIDs))
+    groups.sort(key = lambda group: -group[0])
+
+    # the largest contribution each term can still add.
+    remaining = {}
+    for contribution, token, position, docIDs in groups:
+        remaining[token] = max(remaining.get(token, 0), contribution)
+
+    accumulators = {}
+    processed = 0
+    since_check = 0
+    stopped = len(groups)
+
+    for current, (contribution, token, position, docIDs) in enumerate(groups):
+        for docID in docIDs:
+            accumulators[docID] = accumulators.get(docID, 0) + contribution
+        processed += len(docIDs)
+        since_check += len(docIDs)
+
+        # the term's next group contributes less (or nothing).
+        following = query_vector[token] * terms[token][position + 1][0] if position + 1 < len(terms[token]) else 0
+        remaining[token] = following
+
+        # checking whether the top-k can still change costs a pass over
+        # the accumulators, so it is only done once as many postings were
+        # processed since the last check.
+        if early_termination and len(accumulators) > k and since_check >= len(accumulators):
+            since_check = 0
+            bound = sum(remaining.values())
+            kth, next_best = top_two_gap(accumulators, k)
+
+            # no document outside the top-k (seen or not) can overtake it.
+            if kth > next_best + bound and kth > bound:
+                stopped = current + 1
+                break
+
+    if stopped < len(groups):
+        # completing the scores of the top-k from the remaining groups.
+        top = heapq.nlargest(k, accumulators.items(), key = lambda item: (item[1], item[0]))
+        for contribution, token, position, docIDs in groups[stopped:]:
+            for docID, score in top:
+                found = bisect.bisect_left(docIDs, docID)
+                if found < len(docIDs) and docIDs[found] == docID:
+                    accumulators[docID] += contribution
+        accumulators = {docID: accumulators[docID] for docID, score in top}
+
+    return accumulators, processed
+
+def answer_query(keyword_query, impact_index, k, s, early_termination = True):
+    '''
+    Scores a query on the impact index, and returns the k highest ranked
+    documents as (score, docID), with the number of postings processed.
+    The integer scores are scaled back to weights.
+    '''
+    method = 'lemmatization' if s == 'l' else 'stemming'
+    query_vector = query.build_query_vector(keyword_query, method)
+
+    accumulators, processed = score_at_a_time(query_vector, impact_index, k, early_termination)
+
+    # full-vector cosine divides every score by the same query norm.
+    scale = impact_index['scale']
+    if impact_index['scheme'][2] == 'f':
+        scale = scale / utils.mod_compute(list(query_vector.values()))
+
+    answer = topk.select(accumulators.items(), k)
+    return [(score * scale, docID) for score, docID in answer], processed
+
+def evaluate(answers, relevance):
+    '''
+    Returns the MRR and MAP of the answers of every query with
+    relevance judgments.
+    '''
+    retrieved = {query_id: [docID for score, docID in answers[query_id]] for query_id in answers}
+    relevant = {query_id: relevance[query_id] for query_id in relevance if query_id in retrieved}
+    return mrr(relevant, retrieved), map_k(relevant, retrieved, len(relevant))
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection name
+    sys.argv[2] -> 'ddd' scheme (with 'n' or 'f' normalization)
+    sys.argv[3] -> lemmatization (l) or stemming (s)
+    sys.argv[4] -> number of documents wanted (k)
+    sys.argv[5] -> bits per impact (optional, defaults to 8)
+    eg. python3 ./code/impact_index.py CISI_simplified ltn l 10 8
+
+    Scores every query exhaustively and on the impact index (with and
+    without early termination), and reports the MRR and MAP of each, the
+    postings processed and the time.
+    '''
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n not in [5, 6]:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    scheme = sys.argv[2].lower()
+    if len(scheme) != 3 or scheme[0] not in ['l','n','b'] or scheme[1] not in ['t','n'] or scheme[2] not in ['n','f'] or scheme == 'btf' or scheme == 'bnf':
+        print("- Error: Scheme Not Available For An Impact Index. -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[3] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    if not sys.argv[4].isdigit() or int(sys.argv[4]) <= 0:
+        print("- Error: Incorrect Number of Documents Requested. - ")
+        sys.exit(1)
+
+    bits = 8
+    if n == 6:
+        if not sys.argv[5].isdigit() or not 1 <= int(sys.argv[5]) <= 16:
+            print("- Error: Invalid Number of Bits. -")
+            sys.exit(1)
+        bits = int(sys.argv[5])
+
+    collection, method, k = sys.argv[1], sys.argv[3], int(sys.argv[4])
+    index = query.read_index(collection, method)
+    statistics = query.read_statistics(collection, method)
+    impact_index = load_impact_index(collection, method, scheme, bits, index, statistics)
+
+    queries = read_queries(collection)
+    relevance = read_relevance(collection)
+
+    start = time.perf_counter()
+    exact = {i: query.tokenize_and_answer(queries[i], scheme[0], scheme[1], scheme[2], k, method, index, statistics) for i in queries}
+    exact_time = time.perf_counter() - start
+    exact_postings = sum(index[token][0] for i in queries for token in query.build_query_vector(queries[i], 'lemmatization' if method == 'l' else 'stemming') if token in index)
+    print('exhaustive', ': MRR = ', round(evaluate(exact, relevance)[0], 4), ', MAP = ', round(evaluate(exact, relevance)[1], 4),
+          ', postings = ', exact_postings, ', seconds = ', round(exact_time, 3))
+
+    for early_termination in [False, True]:
+        start = time.perf_counter()
+        results = {i: answer_query(queries[i], impact_index, k, method, early_termination) for i in queries}
+        elapsed = time.perf_counter() - start
+
+        answers = {i: results[i][0] for i in results}
+        result_mrr, result_map = evaluate(answers, relevance)
+        print('impact ' + str(bits) + ' bits' + (' (early termination)' if early_termination else ''), ': MRR = ', round(result_mrr, 4), ', MAP = ', round(result_map, 4),
+              ', postings = ', sum(results[i][1] for i in results), ', seconds = ', round(elapsed, 3))
+
+    exit(0)
@@ -0,0 +1,164 @@
+'''
+
+Lazy reader for the json index.
+
+A term table (term -> [offset, length, df], with the number of documents)
+is written next to the json index. The reader keeps only this table in
+memory, memory maps the json file, and parses the postings of a term
+from its byte range the first time a query asks for it. A bounded cache
+holds the postings of the most recently used terms, so the memory used
+by a query grows with the number of query terms instead of the size of
+the index.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import mmap
+from collections import OrderedDict
+from os.path import exists
+
+TERM_CACHE_SIZE = 1024
+
+def terms_file(collection, method):
+    return './processed/' + collection + '_' + method + '_terms.json'
+
+def build_term_table(index_file):
+    '''
+    Scans a json index written by build_index.write_index (one term per
+    line) and returns its term table: the number of documents, and the
+    byte offset, length and df of every term's entry.
+    '''
+    terms = {}
+    documents = set()
+    offset = 0
+
+    file = open(index_file, 'rb')
+    for line in file:
+        start = offset
+        offset += len(line)
+
+        # skipping the opening and closing braces.
+        if not line.startswith(b'\t'):
+            continue
+
+        separator = line.index(b' : ')
+        value = line[separator + 3:].rstrip(b'\n').rstrip(b',')
+        term = json.loads(line[1:separator])
+
+        # the postings are parsed once here, to count the documents.
+        raw_freq, postings = json.loads(value)
+        for doc_details in postings:
+            documents.add(doc_details[0])
+
+        terms[term] = [start + separator + 3, len(value), raw_freq]
+    file.close()
+
+    return {'N': len(documents), 'terms': terms}
+
+def write_term_table(collection, method):
+    '''
+    Writes the term table of a json index to the processed folder.
+    '''
+    index_file = './processed/' + collection + '_' + method + '.json'
+
+    # checks if it is a valid file.
+    if not exists(index_file):
+        print("- Error: File Doesn't Exist. -")
+        sys.exit(1)
+
+    file = open(terms_file(collection, method), 'w')
+    json.dump(build_term_table(index_file), file)
+    file.close()
+
+class LazyIndex:
+    '''
+    Read-only view of a json index that behaves like the term -> [df,
+    postings] dictionary, loading the postings of a term on demand.
+    '''
+
+    def __init__(self, index_file, table_file, size = TERM_CACHE_SIZE):
+        file = open(table_file)
+        table = json.load(file)
+        file.close()
+
+        self.num_documents = table['N']
+        self.terms = table['terms']
+
+        self.file = open(index_file, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def postings(self, term):
+        '''
+        Returns the [df, postings] entry of a term, parsing it from the
+        mapped file unless it is cached.
+        '''
+        entry = self.cache.get(term)
+        if entry is not None:
+            self.hits += 1
+            self.cache.move_to_end(term)
+            return entry
+
+        self.misses += 1
+        offset, length, raw_freq = self.terms[term]
+        entry = json.loads(self.data[offset:offset + length])
+
+        self.cache[term] = entry
+        if len(self.cache) > self.size:
+            self.cache.popitem(last = False)
+        return entry
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def __getitem__(self, term):
+        if term not in self.terms:
+            raise KeyError(term)
+        return self.postings(term)
+
+    def get(self, term, default = None):
+        if term not in self.terms:
+            return default
+        return self.postings(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection name
+    sys.argv[2] -> lemmatization (l) or stemming (s)
+    eg. python3 ./code/index_reader.py CISI_simplified l
+    '''
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 3:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[2] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    # writing the term table of the existing json index.
+    write_term_table(sys.argv[1], sys.argv[2])
+
+    print("SUCCESS")
+    exit(0)
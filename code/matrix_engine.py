@@ -0,0 +1,221 @@
+'''
+
+Sparse-matrix scoring engine for batches of queries, using NumPy and
+SciPy.
+
+The inverted index is turned into a CSR term-document weight matrix for
+a (tf, idf) scheme, built once and cached in the processed folder
+(rebuilt when the index files change). A
+batch of query vectors is scored with one sparse matrix product,
+followed by vectorized cosine normalization and an argpartition top-k
+(topk.py).
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import time
+from os.path import exists
+import numpy as np
+import scipy.sparse as sparse
+import query
+import utils
+import result_cache
+import topk
+from evaluation import read_queries
+
+def build_matrix(index, tf_scheme, df_scheme, statistics = None):
+    '''
+    Builds the CSR term-document weight matrix of the index for the
+    given tf and idf schemes.
+    '''
+    total_size = utils.number_of_documents(index, statistics)
+
+    terms = list(index)
+    docIDs = sorted({doc_details[0] for term in terms for doc_details in index[term][1]})
+    columns = {docID: column for column, docID in enumerate(docIDs)}
+
+    data, indices, indptr = [], [], [0]
+
+    # one row per term (in the sorted order of the index), with the
+    # weights computed exactly as tokenize_and_answer does.
+    for term in terms:
+        raw_freq, postings = index[term]
+        idf = utils.df_compute(df_scheme, total_size, raw_freq)
+
+        for doc_details in postings:
+            if tf_scheme == 'b':
+                length = statistics['documents'][doc_details[0]]['length']
+                tf_weight = utils.bm25_compute(doc_details[1], length, statistics['average_length'])
+            else:
+                tf_weight = utils.tf_compute(tf_scheme, doc_details[1])
+
+            data.append(tf_weight * idf)
+            indices.append(columns[doc_details[0]])
+        indptr.append(len(data))
+
+    matrix = sparse.csr_matrix((np.array(data, dtype = np.float64), np.array(indices, dtype = np.int32), np.array(indptr, dtype = np.int64)),
+                               shape = (len(terms), len(docIDs)))
+
+    return {'matrix': matrix, 'terms': terms, 'docIDs': np.array(docIDs, dtype = np.int64)}
+
+def prepare(engine):
+    '''
+    Derives the term lookup, the presence matrix and the squared weights
+    used at query time.
+    '''
+    matrix = engine['matrix']
+
+    engine['term_ids'] = {term: row for row, term in enumerate(engine['terms'])}
+    engine['presence'] = sparse.csr_matrix((np.ones_like(matrix.data), matrix.indices, matrix.indptr), shape = matrix.shape)
+    engine['squares'] = sparse.csr_matrix((matrix.data * matrix.data, matrix.indices, matrix.indptr), shape = matrix.shape)
+    return engine
+
+def write_matrix(matrix_file, engine, source):
+    '''
+    Caches the weight matrix, its terms and docIDs in one .npz file, with
+    the signature of the index files it was built from.
+    '''
+    matrix = engine['matrix']
+    np.savez(matrix_file, data = matrix.data, indices = matrix.indices, indptr = matrix.indptr, shape = np.array(matrix.shape),
+             terms = np.array(engine['terms'], dtype = str), docIDs = engine['docIDs'], source = np.array(json.dumps(source)))
+
+def read_matrix(matrix_file, source):
+    '''
+    Reads a cached weight matrix, or returns None if it was built from
+    other index files (or before the signature was stored).
+    '''
+    cached = np.load(matrix_file)
+    if 'source' not in cached.files or str(cached['source']) != json.dumps(source):
+        return None
+
+    matrix = sparse.csr_matrix((cached['data'], cached['indices'], cached['indptr']), shape = tuple(cached['shape']))
+    return {'matrix': matrix, 'terms': cached['terms'].tolist(), 'docIDs': cached['docIDs']}
+
+def load_matrix(collection, method, tf_scheme, df_scheme, index = None, statistics = None):
+    '''
+    Loads the weight matrix of a scheme from the processed folder,
+    building and caching it first if it doesn't exist or the index
+    changed since.
+    '''
+    matrix_file = './processed/' + collection + '_' + method + '_' + tf_scheme + df_scheme + '.npz'
+    source = result_cache.index_signature(collection, method)
+
+    engine = read_matrix(matrix_file, source) if exists(matrix_file) else None
+    if engine is None:
+        if index is None:
+            index = query.read_index(collection, method)
+            statistics = query.read_statistics(collection, method)
+        engine = build_matrix(index, tf_scheme, df_scheme, statistics)
+        write_matrix(matrix_file, engine, source)
+
+    return prepare(engine)
+
+def score_batch(query_vectors, engine, normalization, k, statistics = None, tf_scheme = None, df_scheme = None):
+    '''
+    Scores a batch of query vectors with one sparse matrix product, and
+    returns the k highest ranked documents of each query.
+    '''
+    term_ids = engine['term_ids']
+    docIDs = engine['docIDs']
+
+    rows, columns, values = [], [], []
+    mod_queries = []
+
+    # building the query matrix from the in-vocabulary terms. The query
+    # norm keeps the OOV terms, as tokenize_and_answer does.
+    for row, query_vector in enumerate(query_vectors):
+        for term, count in query_vector.items():
+            if term in term_ids:
+                rows.append(row)
+                columns.append(term_ids[term])
+                values.append(count)
+        mod_queries.append(utils.mod_compute(list(query_vector.values())))
+
+    shape = (len(query_vectors), engine['matrix'].shape[0])
+    queries = sparse.csr_matrix((np.array(values, dtype = np.float64), (rows, columns)), shape = shape)
+    indicator = sparse.csr_matrix((np.ones(len(values)), (rows, columns)), shape = shape)
+
+    # the product accumulates every document's score in the same term
+    # order as the dictionary based engine, so the scores are identical.
+    scores = (queries @ engine['matrix']).toarray()
+    candidates = (indicator @ engine['presence']).toarray() > 0
+
+    if normalization == 'c':
+        mod_documents = np.sqrt((indicator @ engine['squares']).toarray())
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            scores = scores / (np.array(mod_queries)[:, None] * mod_documents)
+    elif normalization == 'f':
+        norms = np.array([statistics['documents'][int(docID)]['norms'][tf_scheme + df_scheme] for docID in docIDs])
+        scores = scores / (np.array(mod_queries)[:, None] * norms[None, :])
+
+    answers = []
+    for row in range(len(query_vectors)):
+        columns = np.flatnonzero(candidates[row])
+        answers.append(topk.select_dense(scores[row, columns], docIDs[columns], k))
+
+    return answers
+
+def answer_batch(keyword_queries, tf_scheme, df_scheme, normalization, k, s, engine, statistics = None):
+    '''
+    Tokenizes and normalizes a batch of queries, and scores them with the
+    sparse-matrix engine.
+    '''
+    if s == 'l':
+        method = 'lemmatization'
+    else:
+        method = 'stemming'
+
+    query_vectors = [query.build_query_vector(keyword_query, method) for keyword_query in keyword_queries]
+    return score_batch(query_vectors, engine, normalization, k, statistics, tf_scheme, df_scheme)
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection name
+    sys.argv[2] -> lemmatization (l) or stemming (s)
+    sys.argv[3] -> number of documents wanted (k)
+    eg. python3 ./code/matrix_engine.py CISI_simplified l 10
+
+    Scores the full query set with both engines for all 8 'ddd' schemes,
+    and reports whether the results match and the speedup.
+    '''
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 4:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[2] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    if not sys.argv[3].isdigit() or int(sys.argv[3]) <= 0:
+        print("- Error: Incorrect Number of Documents Requested. - ")
+        sys.exit(1)
+
+    collection, method, k = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    index = query.read_index(collection, method)
+    statistics = query.read_statistics(collection, method)
+    queries = read_queries(collection)
+    keyword_queries = [queries[i] for i in sorted(queries)]
+
+    for scheme in ['ltn', 'lnn', 'nnn', 'ntn', 'ltc', 'lnc', 'nnc', 'ntc']:
+        engine = load_matrix(collection, method, scheme[0], scheme[1], index, statistics)
+
+        start = time.perf_counter()
+        expected = [query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, statistics) for keyword_query in keyword_queries]
+        dictionary_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        answers = answer_batch(keyword_queries, scheme[0], scheme[1], scheme[2], k, method, engine, statistics)
+        matrix_time = time.perf_counter() - start
+
+        print(scheme, ': match = ', answers == expected, ', dictionary = ', round(dictionary_time, 3), 's , matrix = ',
+              round(matrix_time, 3), 's , speedup = ', round(dictionary_time / matrix_time, 2))
+
+    exit(0)
@@ -0,0 +1,211 @@
+'''
+
+Phrase and proximity operators, evaluated on the positions stored in
+the postings ([docID, tf, [positions]]).
+
+A query can contain quoted phrases ("information retrieval") and
+proximity operators (indexing NEAR/5 retrieval: both terms within 5
+words of each other). The posting lists of the operands are intersected
+first, driving from the rarest term and galloping through the longer
+lists, and only the documents in the intersection have their position
+lists merged. Positions count the normalized terms of a document, so
+the operands are normalized exactly as the documents were.
+
+'''
+
+import re
+import bisect
+from preprocessing import tokenize
+from preprocessing import normalize
+
+# two operands (words or quoted phrases) joined by a NEAR/n operator, or a
+# quoted phrase. The right operand isn't consumed, so it can also be the
+# left operand of a following operator (a NEAR/3 b NEAR/5 c).
+OPERAND = r'("[^"]*"|\S+)'
+OPERATOR = re.compile(OPERAND + r'\s+NEAR/(\d+)\s+(?=' + OPERAND + r')|"([^"]*)"')
+NEAR = re.compile(r'\bNEAR/\d+\b')
+
+def parse_query(keyword_query, method):
+    '''
+    Splits the phrase and proximity operators out of a query. Returns the
+    query text to score (every word, without the operators), its
+    normalized terms in order, and the list of constraints: ('phrase',
+    [terms]) or ('near', [terms], [terms], n).
+    '''
+    constraints = []
+
+    for match in OPERATOR.finditer(keyword_query):
+        if match.group(4) is not None:
+            terms = normalize(tokenize(match.group(4)), method)
+            if terms:
+                constraints.append(('phrase', terms))
+        else:
+            # a quoted operand keeps all of its terms, and must then
+            # occur as a phrase (see operand_positions).
+            left = normalize(tokenize(match.group(1)), method)
+            right = normalize(tokenize(match.group(3)), method)
+            if left and right:
+                constraints.append(('near', left, right, int(match.group(2))))
+
+    # the operator words are still scored, the operators themselves are
+    # not (quotes are removed by tokenize).
+    text = NEAR.sub(' ', keyword_query)
+    return text, normalize(tokenize(text), method), constraints
+
+def gallop(postings, docID, start):
+    '''
+    Returns the index of the first posting at or after start with a docID
+    of at least docID, probing exponentially further ahead before the
+    binary search, so skipping through a long list is cheap.
+    '''
+    if start >= len(postings) or postings[start][0] >= docID:
+        return start
+
+    # postings[low] is always before docID, and the answer is at most high.
+    low, high, step = start, start + 1, 1
+    while high < len(postings) and postings[high][0] < docID:
+        low = high
+        step *= 2
+        high = low + step
+
+    return bisect.bisect_left(postings, docID, low + 1, min(high, len(postings)), key = lambda doc_details: doc_details[0])
+
+def intersect(postings_lists):
+    '''
+    Intersects posting lists sorted by docID, returning for every common
+    document the tuple of its postings (in the order of the lists).
+    '''
+    # walking the rarest list and galloping through the others.
+    order = sorted(range(len(postings_lists)), key = lambda i: len(postings_lists[i]))
+    cursors = [0] * len(postings_lists)
+    matches = []
+
+    for doc_details in postings_lists[order[0]]:
+        docID = doc_details[0]
+        matched = [None] * len(postings_lists)
+        matched[order[0]] = doc_details
+
+        for i in order[1:]:
+            cursors[i] = gallop(postings_lists[i], docID, cursors[i])
+            if cursors[i] == len(postings_lists[i]):
+                return matches
+            if postings_lists[i][cursors[i]][0] != docID:
+                break
+            matched[i] = postings_lists[i][cursors[i]]
+        else:
+            matches.append(tuple(matched))
+
+    return matches
+
+def phrase_occurrences(position_lists):
+    '''
+    Counts the positions where the terms of a phrase follow each other,
+    merging the sorted position lists one term at a time.
+    '''
+    candidates = position_lists[0]
+
+    for offset in range(1, len(position_lists)):
+        shifted = position_lists[offset]
+        kept = []
+        i = j = 0
+
+        # a phrase starting at p needs term 'offset' at p + offset.
+        while i < len(candidates) and j < len(shifted):
+            difference = shifted[j] - offset - candidates[i]
+            if difference == 0:
+                kept.append(candidates[i])
+                i += 1
+                j += 1
+            elif difference < 0:
+                j += 1
+            else:
+                i += 1
+
+        candidates = kept
+        if not candidates:
+            return 0
+
+    return len(candidates)
+
+def minimum_distance(first, second):
+    '''
+    Returns the smallest distance between two sorted position lists.
+    '''
+    best = float('inf')
+    i = j = 0
+
+    while i < len(first) and j < len(second):
+        best = min(best, abs(first[i] - second[j]))
+        if first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+
+    return best
+
+def matching_documents(constraints, inverted_index):
+    '''
+    Returns the set of docIDs satisfying every constraint.
+    '''
+    matching = None
+
+    for constraint in constraints:
+        terms = constraint[1] if constraint[0] == 'phrase' else constraint[1] + constraint[2]
+
+        # a term missing from the index can't match anything.
+        if not all(term in inverted_index for term in terms):
+            return set()
+
+        documents = set()
+        if constraint[0] == 'phrase':
+            for matched in intersect([inverted_index[term][1] for term in terms]):
+                if phrase_occurrences([doc_details[2] for doc_details in matched]) > 0:
+                    documents.add(matched[0][0])
+        else:
+            # each operand is a single word, or a phrase whose start is
+            # used as its position.
+            left, right, window = constraint[1], constraint[2], constraint[3]
+            for matched in intersect([inverted_index[term][1] for term in left + right]):
+                left_positions = operand_positions(matched[:len(left)])
+                right_positions = operand_positions(matched[len(left):])
+                if minimum_distance(left_positions, right_positions) <= window:
+                    documents.add(matched[0][0])
+
+        matching = documents if matching is None else matching & documents
+        if not matching:
+            break
+
+    return matching if matching is not None else set()
+
+def operand_positions(matched):
+    '''
+    Returns the positions where an operand of one or more terms starts.
+    '''
+    if len(matched) == 1:
+        return matched[0][2]
+
+    following = [set(doc_details[2]) for doc_details in matched[1:]]
+    return [start for start in matched[0][2] if all(start + offset in positions for offset, positions in enumerate(following, 1))]
+
+def proximity_boost(terms, inverted_index, documents, weight):
+    '''
+    Computes a boost for every scored document: for each pair of
+    consecutive (distinct) query terms it contains, weight divided by the
+    smallest distance between them.
+    '''
+    pairs = [(terms[i], terms[i + 1]) for i in range(len(terms) - 1) if terms[i] != terms[i + 1]]
+    boosts = {docID: 0 for docID in documents}
+
+    # the positions of every query term in the scored documents.
+    positions = {}
+    for term in set(terms):
+        if term in inverted_index:
+            positions[term] = {doc_details[0]: doc_details[2] for doc_details in inverted_index[term][1] if doc_details[0] in boosts}
+
+    for first, second in pairs:
+        if first not in positions or second not in positions:
+            continue
+        for docID in positions[first].keys() & positions[second].keys():
+            boosts[docID] += weight / minimum_distance(positions[first][docID], positions[second][docID])
+
+    return boosts
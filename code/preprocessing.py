@@ -5,19 +5,157 @@ for this assignment.
 
 '''
 
-import nltk
+import sys
+import profiler
 
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-from nltk.stem import WordNetLemmatizer
+# the NLTK data each component needs, as (resource path, package name).
+# word_tokenize only loads 'punkt_tab' since NLTK 3.9; the legacy 'punkt'
+# pickles aren't enough.
+TOKENIZER_RESOURCES = [('tokenizers/punkt_tab', 'punkt_tab')]
+LEMMATIZER_RESOURCES = [('corpora/wordnet', 'wordnet')]
 
-nltk.download('punkt')
-nltk.download('wordnet')
+# NLTK and its models are only loaded the first time they are used.
+components = {}
 
-stemmer = PorterStemmer()
-lemmatizer = WordNetLemmatizer()
+def missing_resources(resources):
+    '''
+    Returns the packages of the resources that aren't in a local NLTK
+    data folder.
+    '''
+    import nltk
+
+    missing = []
+    for path, package in resources:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+def require_resources(resources):
+    '''
+    Makes sure the resources are available locally. Nothing is ever
+    downloaded here; they are downloaded by build_index.py, or by running
+    this file.
+    '''
+    missing = missing_resources(resources)
+    if missing:
+        print("- Error: NLTK Resource '" + "', '".join(missing) + "' Not Found Locally (run python3 ./code/preprocessing.py). -")
+        sys.exit(1)
+
+def download_resources(lemmatization = True):
+    '''
+    Downloads the NLTK data that isn't already available locally. This is
+    only done when building an index, never while answering queries.
+    '''
+    import nltk
+
+    needed = [TOKENIZER_RESOURCES]
+    if lemmatization:
+        needed.append(LEMMATIZER_RESOURCES)
+
+    for resources in needed:
+        for package in missing_resources(resources):
+            nltk.download(package, quiet = True)
+
+def get_tokenizer():
+    '''
+    Returns NLTK's word_tokenize, loading it on first use.
+    '''
+    if 'tokenizer' not in components:
+        with profiler.timer('nltk_load'):
+            require_resources(TOKENIZER_RESOURCES)
+            from nltk.tokenize import word_tokenize
+            components['tokenizer'] = word_tokenize
+    return components['tokenizer']
+
+def get_stemmer():
+    '''
+    Returns the Porter stemmer, building it on first use (it needs no
+    NLTK data).
+    '''
+    if 'stemmer' not in components:
+        with profiler.timer('nltk_load'):
+            from nltk.stem import PorterStemmer
+            components['stemmer'] = PorterStemmer()
+    return components['stemmer']
+
+def get_lemmatizer():
+    '''
+    Returns the WordNet lemmatizer, loading WordNet on first use, i.e.
+    only when lemmatization is actually requested.
+    '''
+    if 'lemmatizer' not in components:
+        with profiler.timer('nltk_load'):
+            require_resources(LEMMATIZER_RESOURCES)
+            from nltk.stem import WordNetLemmatizer
+            components['lemmatizer'] = WordNetLemmatizer()
+    return components['lemmatizer']
 
 import string
+import json
+from collections import OrderedDict
+
+# the largest number of surface forms kept per normalization method.
+CACHE_SIZE = 100000
+
+class NormalizationCache:
+    '''
+    Bounded cache of surface form -> normalized term, evicting the least
+    recently used form once it is full.
+    '''
+
+    def __init__(self, size = CACHE_SIZE):
+        self.size = size
+        self.terms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        term = self.terms.get(token)
+        if term is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.terms.move_to_end(token)
+        return term
+
+    def put(self, token, term):
+        self.terms[token] = term
+        self.terms.move_to_end(token)
+        if len(self.terms) > self.size:
+            self.terms.popitem(last = False)
+
+    def clear(self):
+        self.terms.clear()
+        self.hits, self.misses = 0, 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+caches = {'stemming': NormalizationCache(), 'lemmatization': NormalizationCache()}
+
+def save_vocabulary(vocabulary_file, method = 'stemming'):
+    '''
+    Writes the cached surface form -> normalized term table of a method.
+    '''
+    file = open(vocabulary_file, 'w')
+    json.dump(dict(caches[method].terms), file)
+    file.close()
+
+def load_vocabulary(vocabulary_file, method = 'stemming'):
+    '''
+    Warms the cache of a method from a surface form -> normalized term
+    table.
+    '''
+    file = open(vocabulary_file)
+    vocabulary = json.load(file)
+    file.close()
+
+    for token, term in vocabulary.items():
+        caches[method].put(token, term)
 
 def tokenize(text):
     '''
@@ -28,7 +166,7 @@ def tokenize(text):
 
     # remove punctuation
     new_text = text.translate(str.maketrans('', '', string.punctuation))
-    tokens = word_tokenize(new_text)
+    tokens = get_tokenizer()(new_text)
 
     return tokens
 
@@ -42,8 +180,32 @@ def normalize(tokens, method = 'stemming'):
     l_cased = [token.lower() for token in tokens]
 
     if method == 'stemming':
-        normalized = [stemmer.stem(token) for token in l_cased]
+        function = get_stemmer().stem
     else:
-        normalized = [lemmatizer.lemmatize(token) for token in l_cased]
+        method = 'lemmatization'
+        function = get_lemmatizer().lemmatize
+
+    # the same surface forms repeat throughout a collection, so each one
+    # is only stemmed or lemmatized once while it stays in the cache.
+    cache = caches[method]
+    normalized = []
+    for token in l_cased:
+        term = cache.get(token)
+        if term is None:
+            term = function(token)
+            cache.put(token, term)
+        normalized.append(term)
 
     return normalized
+
+if __name__ == "__main__":
+    '''
+    main() function
+    Downloads the NLTK data needed for tokenizing, stemming and
+    lemmatizing, without building an index.
+    eg. python3 ./code/preprocessing.py
+    '''
+    download_resources()
+
+    print("SUCCESS")
+    exit(0)
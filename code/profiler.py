@@ -0,0 +1,88 @@
+'''
+
+Named timers and counters for the stages of a query.
+
+Profiling is off by default, and timer then returns a shared no-op
+context, so the instrumented code pays almost nothing. Once enabled,
+the time spent in each named stage and the counters are accumulated
+until reset, and a snapshot of them can be printed as JSON or
+aggregated over a batch of queries.
+
+'''
+
+import time
+import contextlib
+import utils
+
+enabled = False
+timers = {}
+counters = {}
+
+NO_TIMER = contextlib.nullcontext()
+
+class Timer:
+    '''
+    Adds the time spent inside the with block to a named timer.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *arguments):
+        timers[self.name] = timers.get(self.name, 0) + time.perf_counter() - self.start
+
+def timer(name):
+    '''
+    Returns a context timing the named stage, or a no-op context when
+    profiling is off.
+    '''
+    if enabled:
+        return Timer(name)
+    return NO_TIMER
+
+def count(name, value = 1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + value
+
+def enable():
+    global enabled
+    enabled = True
+
+def reset():
+    timers.clear()
+    counters.clear()
+
+def snapshot():
+    '''
+    Returns the timers (in seconds) and counters recorded since the last
+    reset.
+    '''
+    return {'timers': dict(timers), 'counters': dict(counters)}
+
+def distribution(values):
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': utils.percentile(values, 50),
+        'p90': utils.percentile(values, 90),
+        'p99': utils.percentile(values, 99),
+        'max': max(values)
+    }
+
+def aggregate(snapshots):
+    '''
+    Summarizes the snapshots of a batch of queries: the distribution of
+    every timer and counter over the queries that recorded it.
+    '''
+    summary = {'queries': len(snapshots), 'timers': {}, 'counters': {}}
+
+    for kind in ['timers', 'counters']:
+        names = sorted({name for snapshot in snapshots for name in snapshot[kind]})
+        for name in names:
+            summary[kind][name] = distribution([snapshot[kind][name] for snapshot in snapshots if name in snapshot[kind]])
+
+    return summary
@@ -8,17 +8,59 @@ The program will be run from the root of the repository.
 
 '''
 
+import os
 import sys
 import json
+import math
+import bisect
+import itertools
 from os.path import exists
 from preprocessing import tokenize
 from preprocessing import normalize
+from preprocessing import load_vocabulary
+from binary_index import BinaryIndex
+from index_reader import LazyIndex
+from index_reader import terms_file
+from index_reader import write_term_table
+from segments import SegmentedIndex
+from segments import manifest_file
 import utils
+import topk
+import phrase
+import profiler
 
-def read_index(collection, method):
+def read_index(collection, method, lazy = False):
+    '''
+    Reads an inverted index with load_index, timing it for the profiler.
+    '''
+    with profiler.timer('read_index'):
+        return load_index(collection, method, lazy)
+
+def load_index(collection, method, lazy = False):
     '''
     Reads an inverted index (inside the 'processed' folder).
+    The binary index is used when it has been built, otherwise the
+    json index is loaded; when lazy, only its term table is loaded and
+    the postings are read on demand (index_reader.py). If documents
+    were added or deleted since, the live segments are searched along
+    with it.
     '''
+    binary_file = './processed/' + collection + '_' + method + '.idx'
+
+    # warming the normalization cache with the table written next to
+    # the index.
+    vocabulary_file = './processed/' + collection + '_' + method + '_vocab.json'
+    if exists(vocabulary_file):
+        load_vocabulary(vocabulary_file, 'lemmatization' if method == 'l' else 'stemming')
+
+    # the binary index is memory mapped, so opening it costs almost
+    # nothing and postings are only decoded when a query touches them.
+    # A binary index older than the json index was built from a previous
+    # build, so the json index is read instead.
+    json_file = './processed/' + collection + '_' + method + '.json'
+    if exists(binary_file) and (not exists(json_file) or os.stat(binary_file).st_mtime_ns >= os.stat(json_file).st_mtime_ns):
+        return with_segments(BinaryIndex(binary_file), collection, method)
+
     extension = '.json'
     queries_file = './processed/' + collection + '_' + method + extension
 
@@ -26,7 +68,15 @@ def read_index(collection, method):
     if not exists(queries_file):
         print("- Error: File Doesn't Exist. -")
         sys.exit(1)
-    
+
+    # the term table is built on demand, and rebuilt when it is older
+    # than the index, since its offsets point into that file.
+    if lazy:
+        table_file = terms_file(collection, method)
+        if not exists(table_file) or os.stat(table_file).st_mtime_ns < os.stat(queries_file).st_mtime_ns:
+            write_term_table(collection, method)
+        return with_segments(LazyIndex(queries_file, table_file), collection, method)
+
     # opening the file, loading the json data into index and
     # returning the index.
 
@@ -34,8 +84,54 @@ def read_index(collection, method):
     index = json.load(file)
     file.close()
 
+    return with_segments(index, collection, method)
+
+def with_segments(index, collection, method):
+    '''
+    Wraps the base index in a SegmentedIndex when it has segments.
+    '''
+    if exists(manifest_file(collection, method)):
+        return SegmentedIndex(index, collection, method)
     return index
 
+def read_statistics(collection, method):
+    '''
+    Reads the document statistics table (inside the 'processed' folder),
+    or returns None if it hasn't been built.
+    '''
+    statistics_file = './processed/' + collection + '_' + method + '_stats.json'
+
+    # the table only describes the base index, so it can't be used once
+    # documents were added or deleted.
+    if not exists(statistics_file) or exists(manifest_file(collection, method)):
+        return None
+
+    with profiler.timer('read_statistics'):
+        file = open(statistics_file)
+        statistics = json.load(file)
+        file.close()
+
+        # json keys are strings, so the docIDs are converted back.
+        statistics['documents'] = {int(docID): values for docID, values in statistics['documents'].items()}
+    return statistics
+
+def read_bounds(collection, method):
+    '''
+    Reads the per-term maximum impact bounds (inside the 'processed'
+    folder), or returns None if they haven't been built.
+    '''
+    bounds_file = './processed/' + collection + '_' + method + '_bounds.json'
+
+    # the bounds don't cover the segments' postings.
+    if not exists(bounds_file) or exists(manifest_file(collection, method)):
+        return None
+
+    file = open(bounds_file)
+    bounds = json.load(file)
+    file.close()
+
+    return bounds
+
 def build_query_vector(keyword_query, method):
     '''
     Takes a query, tokenizes and normalizes it, builds a query vector
@@ -45,7 +141,10 @@ def build_query_vector(keyword_query, method):
     # taking the query terms and passing it through the same
     # stemmer used for the documents, to build the index if method is 's' otherwise lemmatization used for 'l'.
 
-    terms = normalize(tokenize(keyword_query), method)
+    with profiler.timer('tokenize'):
+        tokens = tokenize(keyword_query)
+    with profiler.timer('normalize'):
+        terms = normalize(tokens, method)
     query_vector = {}
 
     # building query vector, with the key as the term and 
@@ -62,21 +161,25 @@ def build_query_vector(keyword_query, method):
     return query_vector
 
 
-def tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, s):
+def posting_weight(tf_scheme, df_scheme, doc_details, total_size, raw_freq, document_statistics):
     '''
-    Takes a query, tokenizes and normalizes it, builds a query vector, 
-    and scores the documents using the dot product algorithm discussed in class,
-    returns the k highest ranked documents in order.
+    Computes the weight of a posting using the product of tf_compute
+    (or bm25_compute) and df_compute (utils.py).
     '''
-    assert type(keyword_query) == str
-
-    # setting up our query_vector for the method specified.
-    if s == 'l':
-        method = 'lemmatization'
+    if tf_scheme == 'b':
+        length = document_statistics['documents'][doc_details[0]]['length']
+        tf_weight = utils.bm25_compute(doc_details[1], length, document_statistics['average_length'])
     else:
-        method = 'stemming'
+        tf_weight = utils.tf_compute(tf_scheme, doc_details[1])
 
-    query_vector = build_query_vector(keyword_query, method)
+    return tf_weight * utils.df_compute(df_scheme, total_size, raw_freq)
+
+def score_documents(query_vector, tf_scheme, df_scheme, normalization, inverted_index, document_statistics, total_size):
+    '''
+    Scores the documents by building a vector per candidate document and
+    taking its dot product with the query vector. Returns a dictionary
+    of docID -> score.
+    '''
 
     # valid_documents is a dictionary where we set the visited 
     # documents as the ID, and the value as the document_vector to
@@ -88,74 +191,438 @@ def tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, s
     # with the inverted index, it will be referred to as temp.
     temp = 0 
 
-    # computes the total number of documents in the index (utils.py).
-    total_size = utils.number_of_documents(index)
-
-    for token in query_vector:
+    with profiler.timer('postings'):
+        for token in query_vector:
 
-        # handling OOV terms, by ignoring them and incrementing temp.
-        if token not in index:
-            temp += 1
-            continue
-        
-        # otherwise, we take the DF from our index and all the details 
-        # in the other element.
-        raw_freq = index[token][0]
-
-        for doc_details in index[token][1]:
-            docID = doc_details[0]
-
-            # if docID is not in valid_documents, we initialize it.
-            if docID not in valid_documents:
-                valid_documents[docID] = [0] * len(query_vector) 
+            # handling OOV terms, by ignoring them and incrementing temp.
+            if token not in inverted_index:
+                temp += 1
+                continue
+            
+            # otherwise, we take the DF from our index and all the details 
+            # in the other element.
+            raw_freq, postings = inverted_index[token]
+            profiler.count('postings', len(postings))
+
+            for doc_details in postings:
+                docID = doc_details[0]
+
+                # if docID is not in valid_documents, we initialize it.
+                if docID not in valid_documents:
+                    valid_documents[docID] = [0] * len(query_vector) 
+                
+                # setting the document_vector to the weight of the posting.
+                valid_documents[docID][temp] = posting_weight(tf_scheme, df_scheme, doc_details, total_size, raw_freq, document_statistics)
             
-            # computing the weight using the product of tf_compute
-            # and df_compute (utils.py), and setting the document_vector
-            # to the weight.
-            weight = utils.tf_compute(tf_scheme, doc_details[1]) * utils.df_compute(df_scheme, total_size, raw_freq)
-            valid_documents[docID][temp] = weight
-        
-        temp += 1
+            temp += 1
 
     # after weighting all the documents to the scheme, we compute query_values
     # which is the values in a list, and mod_query if normalization is cosine.
     query_values = list(query_vector.values())
-    if normalization == 'c':
+    if normalization in ['c', 'f']:
         mod_query = utils.mod_compute(query_values)
 
     # scoring all the documents
-    for docID in valid_documents:
+    scores = {}
+    with profiler.timer('scoring'):
+        for docID in valid_documents:
+
+            # initialize the score to 0, and compute the dot product of query_values 
+            # and valid_documents.
+            score = 0
+            for temp_index in range(len(valid_documents[docID])):
+                score += (query_values[temp_index] * valid_documents[docID][temp_index])
+            scores[docID] = score
+
+    with profiler.timer('normalization'):
+        for docID in valid_documents:
+            score = scores[docID]
+
+            # for cosine normalization, we compute mod_documents, and decrease the score
+            # by product of mod_documents and mod_query.
+            if normalization == 'c':
+                mod_documents = utils.mod_compute(valid_documents[docID])
+                score = score / (mod_query * mod_documents)
+
+            # for full-vector cosine normalization, the norm of the whole
+            # document vector is read from the statistics table.
+            elif normalization == 'f':
+                mod_documents = document_statistics['documents'][docID]['norms'][tf_scheme + df_scheme]
+                score = score / (mod_query * mod_documents)
+
+            # setting valid_documents[docID] to score, replacing the weights.
+            valid_documents[docID] = score
+
+    return valid_documents
+
+# compact docID slots of the last index (and segment generation) scored
+# term-at-a-time.
+slots_cache = [None, None, None]
+
+def document_slots(inverted_index, document_statistics):
+    '''
+    Maps every docID of the index to a compact slot (0 to N - 1), and
+    returns the mapping with the docIDs in slot order.
+    '''
+    generation = getattr(inverted_index, 'generation', None)
+    if slots_cache[0] is inverted_index and slots_cache[2] == generation:
+        return slots_cache[1]
+
+    # the statistics table lists every document, otherwise the index is
+    # walked once and the mapping is kept for the next queries.
+    if document_statistics is not None:
+        docIDs = sorted(document_statistics['documents'])
+    else:
+        docIDs = sorted({doc_details[0] for token in inverted_index for doc_details in inverted_index[token][1]})
+
+    slots = ({docID: slot for slot, docID in enumerate(docIDs)}, docIDs)
+    slots_cache[0], slots_cache[1], slots_cache[2] = inverted_index, slots, generation
+    return slots
+
+def accumulate_term_at_a_time(query_vector, tf_scheme, df_scheme, normalization, inverted_index, document_statistics, total_size):
+    '''
+    Scores the documents term-at-a-time, adding q_t * w_td straight into
+    a dense score array indexed by compact docID (with a separate norm
+    accumulator for cosine). Returns a dictionary of docID -> score.
+    '''
+    slots, docIDs = document_slots(inverted_index, document_statistics)
+
+    # one allocation per query, instead of one vector per candidate.
+    scores = [0] * len(docIDs)
+    squares = [0] * len(docIDs) if normalization == 'c' else None
+    seen = bytearray(len(docIDs))
+    touched = []
+
+    # the terms are added in the order of the query vector, so the sums
+    # are identical to score_documents.
+    with profiler.timer('postings'):
+        for token, query_weight in query_vector.items():
+            if token not in inverted_index:
+                continue
+
+            raw_freq, postings = inverted_index[token]
+            profiler.count('postings', len(postings))
+            for doc_details in postings:
+                slot = slots[doc_details[0]]
+                weight = posting_weight(tf_scheme, df_scheme, doc_details, total_size, raw_freq, document_statistics)
+
+                if not seen[slot]:
+                    seen[slot] = 1
+                    touched.append(slot)
+                scores[slot] += query_weight * weight
+                if squares is not None:
+                    squares[slot] += weight * weight
+
+    if normalization in ['c', 'f']:
+        mod_query = utils.mod_compute(list(query_vector.values()))
+
+    valid_documents = {}
+    with profiler.timer('normalization'):
+        for slot in touched:
+            docID = docIDs[slot]
+            score = scores[slot]
+
+            # dividing by the norms, as score_documents does.
+            if normalization == 'c':
+                score = score / (mod_query * math.sqrt(squares[slot]))
+            elif normalization == 'f':
+                score = score / (mod_query * document_statistics['documents'][docID]['norms'][tf_scheme + df_scheme])
+
+            valid_documents[docID] = score
+
+    return valid_documents
 
-        # initialize the score to 0, and compute the dot product of query_values 
-        # and valid_documents.
+# number of postings whose weight was computed, across all queries.
+counters = {'postings': 0}
+
+def score_max_score(query_vector, tf_scheme, df_scheme, inverted_index, document_statistics, total_size, term_bounds, k):
+    '''
+    Scores the documents document-at-a-time with MaxScore dynamic
+    pruning: documents whose upper bound can't reach the current top-k
+    are skipped. Returns a dictionary of docID -> score holding exactly
+    the top-k documents of exhaustive scoring (without normalization).
+    '''
+    weighting = tf_scheme + df_scheme
+
+    # every query term with its weight, postings and bound, remembering
+    # its position in the query vector.
+    terms = []
+    for position, (token, query_weight) in enumerate(query_vector.items()):
+        if token not in inverted_index:
+            continue
+        raw_freq, postings = inverted_index[token]
+        terms.append((query_weight * term_bounds[token][weighting], position, query_weight, raw_freq, postings))
+
+    # sorting the terms by increasing bound, with the prefix sums of the
+    # bounds: the terms whose bounds together can't reach the threshold
+    # are non-essential, and only probed for candidates of the others.
+    terms.sort(key = lambda term: term[0])
+    term_count = len(terms)
+    term_bound = [term[0] for term in terms]
+    postings = [term[4] for term in terms]
+    cursors = [0] * term_count
+    current = [term[4][0][0] if term[4] else math.inf for term in terms]
+
+    prefix = []
+    total = 0
+    for bound in term_bound:
+        total += bound
+        prefix.append(total)
+
+    # the bounds are summed in another order than the scores, so a small
+    # slack absorbs the rounding.
+    slack = 1 + 1e-9
+
+    selector = topk.TopK(k)
+    threshold = -math.inf
+    essential = 0
+
+    while True:
+        # moving terms to the non-essential set while the sum of their
+        # bounds can't reach the threshold.
+        while essential < term_count and prefix[essential] * slack < threshold:
+            essential += 1
+        if essential == term_count:
+            break
+
+        # the next candidate is the smallest docID of the essential terms.
+        docID = min(current[essential:])
+        if docID == math.inf:
+            break
+
+        # scoring the essential terms that contain the candidate.
+        contributions = []
+        upper = prefix[essential - 1] if essential > 0 else 0
+        for i in range(essential, term_count):
+            if current[i] == docID:
+                doc_details = postings[i][cursors[i]]
+                contribution = terms[i][2] * posting_weight(tf_scheme, df_scheme, doc_details, total_size, terms[i][3], document_statistics)
+                contributions.append((terms[i][1], contribution))
+                upper += contribution
+
+                cursors[i] += 1
+                current[i] = postings[i][cursors[i]][0] if cursors[i] < len(postings[i]) else math.inf
+        counters['postings'] += len(contributions)
+
+        # probing the non-essential terms, largest bound first, as long as
+        # the candidate can still reach the threshold.
+        for i in range(essential - 1, -1, -1):
+            if upper * slack < threshold:
+                break
+            upper -= term_bound[i]
+
+            if current[i] < docID:
+                cursors[i] = bisect.bisect_left(postings[i], docID, cursors[i], key = lambda doc_details: doc_details[0])
+                current[i] = postings[i][cursors[i]][0] if cursors[i] < len(postings[i]) else math.inf
+
+            if current[i] == docID:
+                doc_details = postings[i][cursors[i]]
+                contribution = terms[i][2] * posting_weight(tf_scheme, df_scheme, doc_details, total_size, terms[i][3], document_statistics)
+                contributions.append((terms[i][1], contribution))
+                upper += contribution
+                counters['postings'] += 1
+
+        if upper * slack < threshold:
+            continue
+
+        # the score is summed in the order of the query vector, so it is
+        # identical to exhaustive scoring.
         score = 0
-        for temp_index in range(len(valid_documents[docID])):
-            score += (query_values[temp_index] * valid_documents[docID][temp_index])
+        for position, contribution in sorted(contributions):
+            score += contribution
 
-        # for cosine normalization, we compute mod_documents, and decrease the score
-        # by product of mod_documents and mod_query.
-        if normalization == 'c':
-            mod_documents = utils.mod_compute(valid_documents[docID])
-            score = score / (mod_query * mod_documents)
+        selector.push(score, docID)
+        threshold = selector.threshold()
 
-        # setting valid_documents[docID] to score, replacing the weights.
-        valid_documents[docID] = score
-    
-    # sorting our valid_documents using the docID as key.
-    valid_documents = dict(sorted(valid_documents.items()))
+    return selector.documents()
 
-    # building a min_heap (utils.py), where the heap is a list of 
-    # tuples, where each tuple is (score, docID).
-    min_heap = utils.heap(valid_documents)
+def tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, s, inverted_index = None, document_statistics = None, mode = 'vector', term_bounds = None, phrases = False, proximity = 0, query_vector = None):
+    '''
+    Takes a query, tokenizes and normalizes it, builds a query vector, 
+    and scores the documents using the dot product algorithm discussed in class,
+    returns the k highest ranked documents in order.
+    The mode selects the scoring: 'vector' (a vector per candidate
+    document), 'taat' (term-at-a-time accumulators) or 'maxscore'
+    (dynamic pruning with the term bounds, for schemes without
+    normalization; cosine schemes are scored term-at-a-time).
+    With phrases, quoted phrases and NEAR/n operators (phrase.py) restrict
+    the answer to the documents matching them, and a proximity weight
+    boosts documents where consecutive query terms are close together.
+    A query vector built beforehand (as answer_batch does) is used
+    instead of normalizing the query again.
+    '''
+    assert type(keyword_query) == str
 
-    # finding the answer (utils.py), where the heap is a list of 
-    # k tuples, where each tuple is (score, docID).
-    answer = utils.largest(min_heap, k)
+    # falling back to the index and statistics loaded by main() if none
+    # are given.
+    if inverted_index is None:
+        inverted_index = index
+    if document_statistics is None:
+        document_statistics = statistics
+    if term_bounds is None:
+        term_bounds = bounds
+
+    # picking up the segments written since the last query.
+    if hasattr(inverted_index, 'refresh'):
+        inverted_index.refresh()
+
+    # BM25 (b) and full-vector cosine (f) need the document statistics.
+    assert document_statistics is not None or (tf_scheme != 'b' and normalization != 'f')
+
+    # setting up our query_vector for the method specified.
+    if s == 'l':
+        method = 'lemmatization'
+    else:
+        method = 'stemming'
+
+    constraints = []
+    if phrases:
+        keyword_query, terms, constraints = phrase.parse_query(keyword_query, method)
+
+    if query_vector is None:
+        query_vector = build_query_vector(keyword_query, method)
+    profiler.count('query_terms', len(query_vector))
+
+    # the operators filter and boost the scored documents, so every
+    # candidate has to be scored.
+    if (constraints or proximity > 0) and mode == 'maxscore':
+        mode = 'taat'
+
+    # computes the total number of documents in the index (utils.py).
+    total_size = utils.number_of_documents(inverted_index, document_statistics)
+
+    if mode == 'maxscore' and normalization == 'n':
+        assert term_bounds is not None
+        evaluated = counters['postings']
+        with profiler.timer('postings'):
+            valid_documents = score_max_score(query_vector, tf_scheme, df_scheme, inverted_index, document_statistics, total_size, term_bounds, k)
+        profiler.count('postings', counters['postings'] - evaluated)
+    elif mode in ['taat', 'maxscore']:
+        valid_documents = accumulate_term_at_a_time(query_vector, tf_scheme, df_scheme, normalization, inverted_index, document_statistics, total_size)
+    else:
+        valid_documents = score_documents(query_vector, tf_scheme, df_scheme, normalization, inverted_index, document_statistics, total_size)
+
+    # the posting lists of the operators are intersected before their
+    # positions are compared.
+    if constraints:
+        with profiler.timer('phrases'):
+            matching = phrase.matching_documents(constraints, inverted_index)
+        valid_documents = {docID: score for docID, score in valid_documents.items() if docID in matching}
+
+    if proximity > 0:
+        if not phrases:
+            terms = normalize(tokenize(keyword_query), method)
+        with profiler.timer('proximity'):
+            boosts = phrase.proximity_boost(terms, inverted_index, valid_documents, proximity)
+        valid_documents = {docID: score + boosts[docID] for docID, score in valid_documents.items()}
+    
+    # finding the answer (topk.py) with a heap of size k, where the
+    # answer is a list of k tuples, where each tuple is (score, docID).
+    profiler.count('candidates', len(valid_documents))
+    with profiler.timer('topk'):
+        answer = topk.select(valid_documents.items(), k)
+    profiler.count('heap_size', len(answer))
 
     return answer
 
+# number of queries whose postings are fetched together in batch mode.
+BATCH_CHUNK_SIZE = 256
+
+def read_batch(batch_file):
+    '''
+    Reads a query file one query at a time, yielding (query ID, query
+    text). Files in the .QRY format (.I/.W) keep their query IDs,
+    otherwise every non-empty line is a query, numbered from 1.
+    '''
+    file = open(batch_file, 'r')
+    current_query_id, current_query_text, count = None, "", 0
+
+    for line in file:
+        line = line.strip()
+
+        # a new query ID ends the previous query, as in read_queries.
+        if line.startswith('.I'):
+            if current_query_id is not None:
+                yield current_query_id, current_query_text.strip()
+            current_query_id, current_query_text = line.split()[1], ""
+        elif line.startswith('.W'):
+            continue
+        elif line != '':
+            if current_query_id is None:
+                count += 1
+                yield str(count), line
+            else:
+                current_query_text += line + ' '
+
+    if current_query_id is not None and current_query_text != "":
+        yield current_query_id, current_query_text.strip()
+    file.close()
+
+class SharedPostings(dict):
+    '''
+    The [df, postings] entries of the terms of a chunk of queries, fetched
+    once from the index and shared by the queries, with the number of
+    documents of the whole index.
+    '''
+
+    def __init__(self, entries, num_documents):
+        super().__init__(entries)
+        self.num_documents = num_documents
+
+def answer_batch(queries, tf_scheme, df_scheme, normalization, k, s, inverted_index, document_statistics = None, chunk_size = BATCH_CHUNK_SIZE, mode = 'vector', phrases = False, proximity = 0):
+    '''
+    Answers a stream of (query ID, query text) chunk by chunk, yielding
+    (query ID, answer) as each query is scored. The queries of a chunk
+    are normalized first, and the postings of every distinct term are
+    fetched (and decoded, for the binary and lazy indexes) once and
+    shared by the chunk, so memory grows with the chunk size rather than
+    the number of queries.
+    '''
+    method = 'lemmatization' if s == 'l' else 'stemming'
+    total_size = utils.number_of_documents(inverted_index, document_statistics)
+    shared = SharedPostings({}, total_size)
+
+    queries = iter(queries)
+    while True:
+        chunk = list(itertools.islice(queries, chunk_size))
+        if not chunk:
+            break
+
+        # picking up the segments written since the last chunk; their
+        # postings replace the ones kept from it.
+        if hasattr(inverted_index, 'refresh'):
+            generation = inverted_index.generation
+            inverted_index.refresh()
+            if inverted_index.generation != generation:
+                total_size = utils.number_of_documents(inverted_index, document_statistics)
+                shared = SharedPostings({}, total_size)
+
+        # scoring the text left once the operators are split out, as
+        # tokenize_and_answer does.
+        vectors = [build_query_vector(phrase.parse_query(keyword_query, method)[0] if phrases else keyword_query, method) for query_id, keyword_query in chunk]
+
+        # terms shared with the previous chunk keep their postings.
+        terms = {token for query_vector in vectors for token in query_vector if token in inverted_index}
+        with profiler.timer('batch_fetch'):
+            shared = SharedPostings({token: shared[token] if token in shared else inverted_index[token] for token in terms}, total_size)
+        profiler.count('batch_terms', len(terms))
+
+        for (query_id, keyword_query), query_vector in zip(chunk, vectors):
+            yield query_id, tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, s, shared, document_statistics, mode, phrases = phrases, proximity = proximity, query_vector = query_vector)
+
+def write_run(answers, tag, output = sys.stdout):
+    '''
+    Streams answers in the TREC run format: query ID, Q0, docID, rank,
+    score and run tag, one document per line.
+    '''
+    for query_id, answer in answers:
+        for rank, (score, docID) in enumerate(answer, 1):
+            print(query_id, 'Q0', docID, rank, score, tag, file = output)
+        output.flush()
 
 index = {}
+statistics = None
+bounds = None
 
 if __name__ == "__main__":
     '''
@@ -164,14 +631,66 @@ if __name__ == "__main__":
     sys.argv[2] -> 'ddd' scheme
     sys.argv[3] -> lemmatization (l) or stemming (s)
     sys.argv[4] -> number of documents wanted (k)
-    sys.argv[5] -> query
+    sys.argv[5] -> query (omitted with --batch)
+    --batch=FILE -> answers every query of a file (.QRY format, or one
+                    query per line) and streams a TREC run
+    --chunk=N -> number of queries sharing the postings fetched in batch
+                 mode (defaults to 256)
+    --tag=NAME -> run tag of the TREC run (defaults to the scheme and
+                  method)
+    --mode=vector|taat|maxscore -> scoring mode (defaults to vector)
+    --phrases -> evaluates quoted phrases and NEAR/n operators
+    --lazy -> reads the postings of the query terms on demand
+    --profile -> prints the time of each stage and the counters as JSON
+    --proximity=W -> boosts documents by W / distance of consecutive
+                     query terms (defaults to 0)
     eg. python3 ./code/query.py CISI_simplified ltn l 10 keyword
+        python3 ./code/query.py CISI_simplified ltn l 10 --batch=./collections/CISI_simplified.QRY
     '''
+    # removing the optional flags before checking the arguments.
+    mode = 'vector'
+    lazy = '--lazy' in sys.argv
+    if '--profile' in sys.argv:
+        profiler.enable()
+    phrases = False
+    proximity = 0
+    batch_file, chunk_size, tag = None, BATCH_CHUNK_SIZE, None
+    for argument in sys.argv[1:]:
+        if argument.startswith('--batch='):
+            batch_file = argument[8:]
+            if not exists(batch_file):
+                print("- Error: Query File Doesn't Exist. -")
+                sys.exit(1)
+        elif argument.startswith('--chunk='):
+            if not argument[8:].isdigit() or int(argument[8:]) <= 0:
+                print("- Error: Invalid Chunk Size. -")
+                sys.exit(1)
+            chunk_size = int(argument[8:])
+        elif argument.startswith('--tag='):
+            tag = argument[6:]
+        elif argument.startswith('--mode='):
+            mode = argument[7:]
+            if mode not in ['vector', 'taat', 'maxscore']:
+                print("- Error: Incorrect Scoring Mode. -")
+                sys.exit(1)
+        elif argument == '--phrases':
+            phrases = True
+        elif argument.startswith('--proximity='):
+            try:
+                proximity = float(argument[12:])
+            except ValueError:
+                proximity = -1
+            if proximity < 0:
+                print("- Error: Incorrect Proximity Weight. -")
+                sys.exit(1)
+    sys.argv = [argument for argument in sys.argv if not argument.startswith('--')]
+
     # read the collection name from command line
     n = len(sys.argv)
 
     # Checking if correct number of command line arguements are provided
-    if n != 6:
+    # (the queries come from the file in batch mode).
+    if n != (5 if batch_file is not None else 6):
         print("- Error: Incorrect Number of Arguments -")
         sys.exit(1)
 
@@ -183,8 +702,8 @@ if __name__ == "__main__":
     # setting our scheme to all lowercase.
     sys.argv[2] = sys.argv[2].lower()
 
-    # checking if tf scheme is one of ['l','n'].
-    if sys.argv[2][0] not in ['l','n']:
+    # checking if tf scheme is one of ['l','n','b'].
+    if sys.argv[2][0] not in ['l','n','b']:
         print("- Error: Incorrect 'tf' Input. -")
         sys.exit(1)
 
@@ -193,10 +712,15 @@ if __name__ == "__main__":
         print("- Error: Incorrect 'idf' Input. -")
         sys.exit(1)
 
-    # checking if normalization scheme is one of ['c','n'].
-    if sys.argv[2][2] not in ['c','n']:
+    # checking if normalization scheme is one of ['c','n','f'].
+    if sys.argv[2][2] not in ['c','n','f']:
         print("- Error: Incorrect 'Normalization' Input. -")
         sys.exit(1)
+
+    # the full-vector norms are only stored for the 'l' and 'n' tf.
+    if sys.argv[2][0] == 'b' and sys.argv[2][2] == 'f':
+        print("- Error: Full-Vector Cosine Is Not Available For BM25. -")
+        sys.exit(1)
     
     # checking if we can convert our string(k) into int(k).
     try:
@@ -214,14 +738,46 @@ if __name__ == "__main__":
         print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
 
     # after these errors have been handled, we can read our index correctly.
-    index = read_index(sys.argv[1], sys.argv[3])
+    index = read_index(sys.argv[1], sys.argv[3], lazy)
+
+    # the statistics table grows with the collection, and vector scoring
+    # only needs it for BM25 and full-vector cosine.
+    if lazy and mode == 'vector' and sys.argv[2][0] != 'b' and sys.argv[2][2] != 'f':
+        statistics = None
+    else:
+        statistics = read_statistics(sys.argv[1], sys.argv[3])
+
+    # BM25 and full-vector cosine need the document statistics table.
+    if statistics is None and (sys.argv[2][0] == 'b' or sys.argv[2][2] == 'f'):
+        print("- Error: Document Statistics Don't Exist. -")
+        sys.exit(1)
+
+    # dynamic pruning needs the term bounds.
+    if mode == 'maxscore':
+        bounds = read_bounds(sys.argv[1], sys.argv[3])
+        if bounds is None:
+            print("- Error: Term Bounds Don't Exist. -")
+            sys.exit(1)
+
+    # streaming the run as the chunks are scored.
+    if batch_file is not None:
+        answers = answer_batch(read_batch(batch_file), sys.argv[2][0], sys.argv[2][1], sys.argv[2][2], k, sys.argv[3], index, statistics, chunk_size, mode, phrases, proximity)
+        write_run(answers, tag if tag is not None else sys.argv[2] + '_' + sys.argv[3])
+
+        if profiler.enabled:
+            print(json.dumps(profiler.snapshot()))
+        exit(0)
 
     # once we've loaded our index correctly, we can find the documents relevant
     # to the query.
-    answer = tokenize_and_answer(sys.argv[5], sys.argv[2][0], sys.argv[2][1], sys.argv[2][2], int(sys.argv[4]), sys.argv[3])
+    answer = tokenize_and_answer(sys.argv[5], sys.argv[2][0], sys.argv[2][1], sys.argv[2][2], int(sys.argv[4]), sys.argv[3], mode = mode, phrases = phrases, proximity = proximity)
 
     # printing our answer in the given format.
     for score, docID in answer:
         print(docID, '\t', round(score, 3))
+
+    # the profile is printed last, on a single line.
+    if profiler.enabled:
+        print(json.dumps(profiler.snapshot()))
     
     exit(0)
\ No newline at end of file
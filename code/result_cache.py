@@ -0,0 +1,148 @@
+'''
+
+Query result cache in front of tokenize_and_answer.
+
+Results are keyed by (collection, method, normalized query vector,
+scheme, segment generation), so queries that only differ in case,
+punctuation or word forms share an entry. Each entry holds the deepest
+ranking computed so far, and a smaller k is answered from it with
+topk.select, which keeps the tie handling at the cut-off identical to
+scoring with k directly. Entries are evicted least recently used first,
+and the entries of an index are dropped when any of its files change.
+
+The segments of an index are refreshed before every lookup, so an
+update is never answered from (or cached under) an older generation.
+The base index in memory isn't reloaded here: a long-running process
+reloads it when base_signature changes (server.py).
+
+'''
+
+import os
+from collections import OrderedDict
+from os.path import exists
+import query
+import topk
+
+RESULT_CACHE_SIZE = 10000
+
+def base_signature(collection, method):
+    '''
+    Returns the (file, modification time, size) of the files an index is
+    loaded from, with whether it has segments.
+    '''
+    prefix = './processed/' + collection + '_' + method
+    signature = []
+
+    for suffix in ['.json', '.idx', '_stats.json']:
+        if exists(prefix + suffix):
+            status = os.stat(prefix + suffix)
+            signature.append((suffix, status.st_mtime_ns, status.st_size))
+    signature.append(('_segments.json', exists(prefix + '_segments.json')))
+
+    return tuple(signature)
+
+def index_signature(collection, method):
+    '''
+    Returns the (file, modification time, size) of every file the
+    answers of an index depend on.
+    '''
+    signature = list(base_signature(collection, method))
+
+    manifest = './processed/' + collection + '_' + method + '_segments.json'
+    if exists(manifest):
+        status = os.stat(manifest)
+        signature.append(('_segments.json', status.st_mtime_ns, status.st_size))
+
+    return tuple(signature)
+
+class ResultCache:
+    '''
+    Bounded cache of rankings, evicting the least recently used query
+    once it is full.
+    '''
+
+    def __init__(self, size = RESULT_CACHE_SIZE):
+        self.size = size
+        self.rankings = OrderedDict()
+        self.signatures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, collection, method):
+        '''
+        Drops the entries of an index whose files changed since they were
+        cached.
+        '''
+        signature = index_signature(collection, method)
+        if self.signatures.get((collection, method)) == signature:
+            return
+
+        for key in [key for key in self.rankings if key[0] == collection and key[1] == method]:
+            del self.rankings[key]
+        self.signatures[(collection, method)] = signature
+
+    def key(self, collection, keyword_query, scheme, method, inverted_index = None):
+        '''
+        Returns the cache key of a query, refreshing the segments of the
+        index first.
+        '''
+        self.check(collection, method)
+
+        # the throttled refresh in tokenize_and_answer could still see the
+        # segments from before an update.
+        if inverted_index is None:
+            inverted_index = query.index
+        if hasattr(inverted_index, 'refresh'):
+            inverted_index.refresh(force = True)
+
+        query_vector = query.build_query_vector(keyword_query, 'lemmatization' if method == 'l' else 'stemming')
+        return (collection, method, tuple(query_vector.items()), scheme, getattr(inverted_index, 'generation', None))
+
+    def lookup(self, key, k):
+        '''
+        Returns the top k of the cached ranking of a key when it is at
+        least k deep (or complete), otherwise None.
+        '''
+        # a ranking shorter than its depth holds every scored document.
+        cached = self.rankings.get(key)
+        if cached is not None and (k <= cached[0] or len(cached[1]) < cached[0]):
+            self.hits += 1
+            self.rankings.move_to_end(key)
+            return topk.select(((docID, score) for score, docID in cached[1]), k)
+
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, ranking):
+        '''
+        Caches the ranking of a key, scored with k = depth.
+        '''
+        self.rankings[key] = (depth, ranking)
+        self.rankings.move_to_end(key)
+        if len(self.rankings) > self.size:
+            self.rankings.popitem(last = False)
+
+    def answer(self, collection, keyword_query, scheme, k, method, inverted_index = None, document_statistics = None):
+        '''
+        Returns what tokenize_and_answer would, from the cache when a
+        ranking at least k deep (or complete) is cached for the query.
+        '''
+        key = self.key(collection, keyword_query, scheme, method, inverted_index)
+
+        ranking = self.lookup(key, k)
+        if ranking is None:
+            ranking = query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, inverted_index, document_statistics)
+            self.store(key, k, ranking)
+
+        return ranking
+
+    def clear(self):
+        self.rankings.clear()
+        self.signatures.clear()
+        self.hits, self.misses = 0, 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+results = ResultCache()
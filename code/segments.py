@@ -0,0 +1,477 @@
+'''
+
+Incremental index updates with segments.
+
+New or updated documents are written into small immutable segments
+next to the base index, and deletions are recorded in a manifest, so
+the base index never has to be rebuilt. Every segment has a generation
+(the base index is generation 0), and a version of a document is live
+as long as it isn't older than the document's last update or deletion.
+
+query.py searches the base index and the live segments together, and a
+size-tiered merge policy compacts the segments in the background after
+each update, in a detached process. Readers never take the lock: a merge only removes its inputs once the
+manifest no longer lists them.
+
+The program will be run from the root of the repository.
+
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import subprocess
+from os.path import exists
+from build_index import iter_documents
+from build_index import build_index
+
+# segments are merged once this many of them fall into the same size tier.
+MERGE_FACTOR = 4
+
+# how often (in seconds) a SegmentedIndex checks for a new manifest.
+REFRESH_INTERVAL = 1.0
+
+def manifest_file(collection, method):
+    return './processed/' + collection + '_' + method + '_segments.json'
+
+def segment_file(collection, method, generation):
+    return './processed/' + collection + '_' + method + '_seg' + str(generation).zfill(4) + '.json'
+
+def write_atomically(path, data):
+    '''
+    Writes json data to a temporary file and renames it into place, so
+    readers never see a partial file.
+    '''
+    temporary = path + '.tmp'
+    file = open(temporary, 'w')
+    json.dump(data, file)
+    file.close()
+    os.replace(temporary, path)
+
+def read_json(path):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    return data
+
+def read_manifest(collection, method):
+    '''
+    Reads the manifest, or returns an empty one if there are no segments.
+    '''
+    path = manifest_file(collection, method)
+
+    if not exists(path):
+        return {'next': 1, 'segments': [], 'deleted': {}}
+
+    manifest = read_json(path)
+    # json keys are strings, so the docIDs are converted back.
+    manifest['deleted'] = {int(docID): generation for docID, generation in manifest['deleted'].items()}
+    return manifest
+
+def write_manifest(collection, method, manifest):
+    write_atomically(manifest_file(collection, method), manifest)
+
+def is_live(manifest, docID, generation):
+    '''
+    Checks whether the version of a document in the given generation
+    hasn't been replaced or deleted since.
+    '''
+    return generation >= manifest['deleted'].get(docID, 0)
+
+def process_alive(pid):
+    '''
+    Checks whether a process with the given PID is running.
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class WriteLock:
+    '''
+    Lock file making sure a single process updates the segments of an
+    index at a time. The lock file holds the PID of its owner, so the lock
+    of a process that died without releasing it is broken.
+    '''
+
+    def __init__(self, collection, method):
+        self.path = './processed/' + collection + '_' + method + '_segments.lock'
+
+    def __enter__(self):
+        while True:
+            try:
+                descriptor = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(descriptor, str(os.getpid()).encode())
+                os.close(descriptor)
+                return self
+            except FileExistsError:
+                if self.stale():
+                    self.break_lock()
+                else:
+                    time.sleep(0.05)
+
+    def owner(self, path):
+        '''
+        Returns the PID recorded in a lock file, or None if it can't be
+        read (it may have just been created, or removed).
+        '''
+        try:
+            file = open(path)
+            content = file.read()
+            file.close()
+        except FileNotFoundError:
+            return None
+        return int(content) if content.isdigit() else None
+
+    def stale(self):
+        '''
+        Checks whether the lock is held by a process that no longer runs.
+        An empty lock file is only stale once it is older than a second,
+        since its owner writes the PID right after creating it.
+        '''
+        pid = self.owner(self.path)
+        if pid is not None:
+            return not process_alive(pid)
+        try:
+            return time.time() - os.stat(self.path).st_mtime > 1
+        except FileNotFoundError:
+            return False
+
+    def break_lock(self):
+        '''
+        Removes a stale lock. It is first moved aside, so if another
+        process broke it and took the lock in the meantime, that live lock
+        is put back instead of removed.
+        '''
+        aside = self.path + '.' + str(os.getpid())
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return
+
+        pid = self.owner(aside)
+        if pid is not None and process_alive(pid):
+            try:
+                os.link(aside, self.path)
+            except FileExistsError:
+                pass
+        os.remove(aside)
+
+    def __exit__(self, *arguments):
+        os.remove(self.path)
+
+def add_documents(collection, method, documents):
+    '''
+    Indexes the documents (docID -> text, or an iterable of (docID, text))
+    into a new segment, replacing any older version of them.
+    '''
+    index = build_index(documents, method)
+    docIDs = sorted({doc_details[0] for term in index for doc_details in index[term][1]})
+
+    with WriteLock(collection, method):
+        manifest = read_manifest(collection, method)
+        generation = manifest['next']
+
+        # the segment is written before the manifest points to it.
+        write_atomically(segment_file(collection, method, generation), index)
+
+        manifest['next'] = generation + 1
+        manifest['segments'].append({'generation': generation, 'documents': len(docIDs)})
+        for docID in docIDs:
+            manifest['deleted'][docID] = generation
+        write_manifest(collection, method, manifest)
+
+    return generation
+
+def delete_documents(collection, method, docIDs):
+    '''
+    Deletes every existing version of the documents.
+    '''
+    with WriteLock(collection, method):
+        manifest = read_manifest(collection, method)
+
+        # versions older than the next generation are no longer live.
+        for docID in docIDs:
+            manifest['deleted'][docID] = manifest['next']
+        manifest['next'] += 1
+        write_manifest(collection, method, manifest)
+
+def tier(documents):
+    '''
+    Returns the size tier of a segment holding the given number of
+    documents.
+    '''
+    return int(math.log(max(documents, 1), MERGE_FACTOR))
+
+def merge_candidates(manifest):
+    '''
+    Picks the oldest MERGE_FACTOR segments of the first size tier that
+    has enough of them, or returns None.
+    '''
+    tiers = {}
+    for segment in manifest['segments']:
+        tiers.setdefault(tier(segment['documents']), []).append(segment)
+
+    for level in sorted(tiers):
+        if len(tiers[level]) >= MERGE_FACTOR:
+            return tiers[level][:MERGE_FACTOR]
+    return None
+
+def merge_segments(collection, method, segments):
+    '''
+    Merges segments into one, keeping only their live postings. The merged
+    segment is written under a new generation, newer than every version
+    it keeps, and only replaces its inputs once the manifest lists it.
+    Returns False, merging nothing, if another merge already replaced
+    some of the segments.
+    '''
+    with WriteLock(collection, method):
+        manifest = read_manifest(collection, method)
+        generations = [segment['generation'] for segment in segments]
+        generation = manifest['next']
+
+        # the segments were picked before the lock was taken.
+        listed = {segment['generation'] for segment in manifest['segments']}
+        if not all(current in listed for current in generations):
+            return False
+
+        merged = {}
+        documents = set()
+        for current in sorted(generations):
+            index = read_json(segment_file(collection, method, current))
+            for term in index:
+                for doc_details in index[term][1]:
+                    if is_live(manifest, doc_details[0], current):
+                        merged.setdefault(term, []).append(doc_details)
+                        documents.add(doc_details[0])
+
+        index = {}
+        for term in sorted(merged):
+            postings = sorted(merged[term], key = lambda doc_details: doc_details[0])
+            index[term] = [len(postings), postings]
+
+        # no manifest lists the new generation yet, so readers can't see
+        # the merged segment until the manifest below replaces the inputs.
+        write_atomically(segment_file(collection, method, generation), index)
+
+        manifest['next'] = generation + 1
+        manifest['segments'] = [segment for segment in manifest['segments'] if segment['generation'] not in generations]
+        manifest['segments'].append({'generation': generation, 'documents': len(documents)})
+        write_manifest(collection, method, manifest)
+
+        # readers still holding the old manifest reload when a file it
+        # lists disappears (SegmentedIndex.load).
+        for current in generations:
+            os.remove(segment_file(collection, method, current))
+    return True
+
+def merge(collection, method):
+    '''
+    Applies the merge policy until no size tier has MERGE_FACTOR segments.
+    '''
+    while True:
+        segments = merge_candidates(read_manifest(collection, method))
+        if segments is None:
+            return
+        merge_segments(collection, method, segments)
+
+def merge_in_background(collection, method):
+    '''
+    Starts 'segments.py merge' in a detached process, which keeps running
+    after the calling process exits. Queries keep reading the current
+    segments until it switches the manifest.
+    '''
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'merge', collection, method],
+                            stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+                            start_new_session = True)
+
+class SegmentedIndex:
+    '''
+    Read-only view of the base index and its live segments that behaves
+    like the term -> [df, postings] dictionary of a single index.
+    refresh is called before each query and reads the manifest again at
+    most every REFRESH_INTERVAL seconds, so updates become visible without
+    reloading the base index, and a query never sees two versions.
+    '''
+
+    def __init__(self, base, collection, method):
+        self.base = base
+        self.collection = collection
+        self.method = method
+        self.modified = None
+        self.checked = 0
+        self.generation = 0
+        self.base_docIDs = None
+        self.load()
+
+    def load(self):
+        '''
+        Reads the manifest and the segments it lists. A merge may remove
+        the segments of the manifest being read, in which case the newer
+        manifest is read again.
+        '''
+        path = manifest_file(self.collection, self.method)
+        while True:
+            self.modified = os.stat(path).st_mtime_ns if exists(path) else None
+            self.manifest = read_manifest(self.collection, self.method)
+            try:
+                self.segments = [(segment['generation'], read_json(segment_file(self.collection, self.method, segment['generation'])))
+                                 for segment in self.manifest['segments']]
+                break
+            except FileNotFoundError:
+                continue
+        self.merged = {}
+        self.generation = self.manifest['next']
+        self.num_documents = self.count_documents()
+
+    def refresh(self, force = False):
+        '''
+        Reloads the segments if the manifest changed since they were read.
+        Unless forced, the manifest is checked at most every
+        REFRESH_INTERVAL seconds.
+        '''
+        now = time.monotonic()
+        if not force and now - self.checked < REFRESH_INTERVAL:
+            return
+        self.checked = now
+
+        path = manifest_file(self.collection, self.method)
+        modified = os.stat(path).st_mtime_ns if exists(path) else None
+        if modified != self.modified:
+            self.load()
+
+    def base_documents(self):
+        '''
+        Returns the docIDs of the base index, collected once: the base
+        never changes, only the manifest does.
+        '''
+        if self.base_docIDs is None:
+            self.base_docIDs = {doc_details[0] for term in self.base for doc_details in self.base[term][1]}
+        return self.base_docIDs
+
+    def count_documents(self):
+        '''
+        Counts the live documents: the documents of the base index, less
+        the ones updated or deleted since, plus the live documents of the
+        segments (a document has at most one live version).
+        '''
+        # the binary and lazy indexes store their number of documents.
+        base_size = getattr(self.base, 'num_documents', None)
+        if base_size is None:
+            base_size = len(self.base_documents())
+
+        replaced = 0
+        if self.manifest['deleted']:
+            base_docIDs = self.base_documents()
+            replaced = sum(1 for docID in self.manifest['deleted'] if docID in base_docIDs)
+
+        live = set()
+        for generation, index in self.segments:
+            for term in index:
+                for doc_details in index[term][1]:
+                    if is_live(self.manifest, doc_details[0], generation):
+                        live.add(doc_details[0])
+        return base_size - replaced + len(live)
+
+    def postings(self, term):
+        '''
+        Merges the live postings of a term across the base index and the
+        segments, in increasing docID order.
+        '''
+        if term in self.merged:
+            return self.merged[term]
+
+        postings = []
+        if term in self.base:
+            postings += [doc_details for doc_details in self.base[term][1] if is_live(self.manifest, doc_details[0], 0)]
+        for generation, index in self.segments:
+            if term in index:
+                postings += [doc_details for doc_details in index[term][1] if is_live(self.manifest, doc_details[0], generation)]
+
+        postings.sort(key = lambda doc_details: doc_details[0])
+        self.merged[term] = postings
+        return postings
+
+    def __contains__(self, term):
+        return len(self.postings(term)) > 0
+
+    def __getitem__(self, term):
+        postings = self.postings(term)
+        if not postings:
+            raise KeyError(term)
+        return [len(postings), postings]
+
+    def get(self, term, default = None):
+        postings = self.postings(term)
+        if not postings:
+            return default
+        return [len(postings), postings]
+
+    def __iter__(self):
+        terms = set(self.base)
+        for generation, index in self.segments:
+            terms.update(index)
+        for term in sorted(terms):
+            if term in self:
+                yield term
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> add, delete or merge
+    sys.argv[2] -> collection name
+    sys.argv[3] -> lemmatization (l) or stemming (s)
+
+    add: sys.argv[4] -> collection (inside the 'collections' folder) with
+                        the new or updated documents, in the .ALL format
+    eg. python3 ./code/segments.py add CISI_simplified l CISI_updates
+
+    delete: sys.argv[4:] -> docIDs to delete
+    eg. python3 ./code/segments.py delete CISI_simplified l 12 13
+
+    merge: applies the merge policy
+    eg. python3 ./code/segments.py merge CISI_simplified l
+    '''
+    n = len(sys.argv)
+
+    if n < 4:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[3] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    collection, method = sys.argv[2], sys.argv[3]
+
+    if sys.argv[1] == 'add' and n == 5:
+        generation = add_documents(collection, method, iter_documents(sys.argv[4]))
+        print("Segment " + str(generation) + " Written")
+
+        # compacting the segments in a process of its own, so the update
+        # returns right away.
+        if merge_candidates(read_manifest(collection, method)) is not None:
+            merge_in_background(collection, method)
+            print("Merge Started in the Background")
+
+    elif sys.argv[1] == 'delete' and n > 4:
+        if not all(docID.isdigit() for docID in sys.argv[4:]):
+            print("- Error: Invalid DocID. -")
+            sys.exit(1)
+        delete_documents(collection, method, [int(docID) for docID in sys.argv[4:]])
+
+    elif sys.argv[1] == 'merge' and n == 4:
+        merge(collection, method)
+
+    else:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    print("SUCCESS")
+    exit(0)
@@ -0,0 +1,293 @@
+'''
+
+Long-running query server. Loads one or more (collection, method)
+indexes once (again if they are rebuilt) and answers queries sent over
+a local (unix) socket, one JSON object per line, with the results as
+JSON lines.
+
+Requests that arrive close together are micro-batched: a batch is
+scored in one call to the worker thread, and the requests of a batch
+on the same index and scheme share the postings fetched for them.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import time
+import random
+import asyncio
+import subprocess
+import query
+import utils
+import topk
+import result_cache
+from evaluation import read_queries
+
+# how long the batcher waits for more requests after the first one, and
+# the largest batch scored at once.
+BATCH_WINDOW = 0.002
+BATCH_SIZE = 32
+
+def check_request(request, indexes):
+    '''
+    Validates a request, and returns an error message or None.
+    '''
+    if type(request) != dict:
+        return "Request Must Be A JSON Object."
+
+    if (request.get('collection'), request.get('method')) not in indexes:
+        return "Index Not Loaded."
+
+    scheme = request.get('scheme')
+    if type(scheme) != str or len(scheme) != 3:
+        return "Incorrect 'ddd' Scheme Input."
+
+    scheme = scheme.lower()
+    if scheme[0] not in ['l','n','b'] or scheme[1] not in ['t','n'] or scheme[2] not in ['c','n','f']:
+        return "Incorrect 'ddd' Scheme Input."
+
+    # BM25 and full-vector cosine need the document statistics table.
+    statistics = indexes[(request['collection'], request['method'])][1]
+    if (scheme[0] == 'b' or scheme[2] == 'f') and (statistics is None or scheme[0] + scheme[2] == 'bf'):
+        return "Scheme Not Available For This Index."
+
+    if type(request.get('k')) != int or request['k'] <= 0:
+        return "Incorrect Number of Documents Requested."
+
+    if type(request.get('query')) != str:
+        return "Query Must Be A String."
+
+    return None
+
+def reload_changed(batch, indexes, signatures):
+    '''
+    Reloads the indexes of a batch whose files were rebuilt (or that got
+    segments) since they were loaded, so the cache isn't refilled from
+    the old index.
+    '''
+    for key in {(request['collection'], request['method']) for request in batch}:
+        signature = result_cache.base_signature(*key)
+        if signatures.get(key) != signature:
+            indexes[key] = (query.read_index(*key), query.read_statistics(*key))
+            signatures[key] = signature
+
+def answer_batch(batch, indexes):
+    '''
+    Scores a batch of validated requests, and returns one response per
+    request. Requests missing from the result cache are grouped by
+    (collection, method, scheme), and each group is scored with
+    query.answer_batch, so the queries of a group share the postings of
+    their terms. A group is scored at its largest k, and every request
+    takes its own top k from that ranking.
+    '''
+    answers = [None] * len(batch)
+    groups = {}
+
+    for position, request in enumerate(batch):
+        scheme = request['scheme'].lower()
+        index, statistics = indexes[(request['collection'], request['method'])]
+
+        key = result_cache.results.key(request['collection'], request['query'], scheme, request['method'], index)
+        answers[position] = result_cache.results.lookup(key, request['k'])
+        if answers[position] is None:
+            groups.setdefault((request['collection'], request['method'], scheme), []).append((position, key))
+
+    for (collection, method, scheme), missed in groups.items():
+        index, statistics = indexes[(collection, method)]
+        depth = max(batch[position]['k'] for position, key in missed)
+        keys = dict(missed)
+
+        queries = [(position, batch[position]['query']) for position, key in missed]
+        for position, ranking in query.answer_batch(queries, scheme[0], scheme[1], scheme[2], depth, method, index, statistics, len(queries)):
+            result_cache.results.store(keys[position], depth, ranking)
+            answers[position] = topk.select(((docID, score) for score, docID in ranking), batch[position]['k'])
+
+    return [{'id': request.get('id'), 'results': [[docID, score] for score, docID in answer]} for request, answer in zip(batch, answers)]
+
+class QueryServer:
+    '''
+    Accepts connections on a unix socket, and queues every request for
+    the batcher.
+    '''
+
+    def __init__(self, indexes, signatures):
+        self.indexes = indexes
+        self.signatures = signatures
+        self.queue = asyncio.Queue()
+
+    async def batcher(self):
+        '''
+        Collects the requests that arrive within BATCH_WINDOW of the first
+        one, and scores them together off the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, future in batch]
+            try:
+                await loop.run_in_executor(None, reload_changed, requests, self.indexes, self.signatures)
+                responses = await loop.run_in_executor(None, answer_batch, requests, self.indexes)
+            except Exception as error:
+                responses = [{'id': request.get('id'), 'error': str(error)} for request in requests]
+
+            for (request, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def handle(self, reader, writer):
+        '''
+        Reads JSON lines from a client, and writes back one JSON line per
+        request, in the order they were sent.
+        '''
+        loop = asyncio.get_running_loop()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                request = json.loads(line)
+                error = check_request(request, self.indexes)
+            except ValueError:
+                request, error = {}, "Invalid JSON."
+
+            # {"stats": true} reports the result cache counters.
+            if type(request) == dict and request.get('stats') is True:
+                cache = result_cache.results
+                response = {'id': request.get('id'), 'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hit_rate()}
+            elif error is not None:
+                response = {'id': request.get('id') if type(request) == dict else None, 'error': error}
+            else:
+                future = loop.create_future()
+                await self.queue.put((request, future))
+                response = await future
+
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+
+        writer.close()
+
+    async def serve(self, socket_path):
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_unix_server(self.handle, path = socket_path)
+
+        print("Listening On " + socket_path, flush = True)
+        async with server:
+            await server.serve_forever()
+        batcher.cancel()
+
+async def send_queries(socket_path, requests):
+    '''
+    Sends the requests over one connection, and returns the latency of
+    each response.
+    '''
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    latencies = []
+
+    for request in requests:
+        start = time.perf_counter()
+        writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await writer.drain()
+        await reader.readline()
+        latencies.append(time.perf_counter() - start)
+
+    writer.close()
+    return latencies
+
+async def benchmark_server(socket_path, requests, clients):
+    '''
+    Splits the requests across concurrent clients, and returns the
+    latencies with the total elapsed time.
+    '''
+    start = time.perf_counter()
+    results = await asyncio.gather(*[send_queries(socket_path, requests[i::clients]) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    return [latency for latencies in results for latency in latencies], elapsed
+
+def benchmark_cli(requests):
+    '''
+    Runs query.py once per request, and returns the latencies with the
+    total elapsed time.
+    '''
+    latencies = []
+    start = time.perf_counter()
+
+    for request in requests:
+        begin = time.perf_counter()
+        subprocess.check_output(["python3", "./code/query.py", request['collection'], request['scheme'], request['method'], str(request['k']), request['query']])
+        latencies.append(time.perf_counter() - begin)
+
+    return latencies, time.perf_counter() - start
+
+def report(name, latencies, elapsed):
+    print(name, ': throughput = ', round(len(latencies) / elapsed, 2), 'queries/s , p50 = ',
+          round(utils.percentile(latencies, 50) * 1000, 2), 'ms , p99 = ', round(utils.percentile(latencies, 99) * 1000, 2), 'ms')
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> serve or bench
+    sys.argv[2] -> unix socket path
+
+    serve: sys.argv[3:] -> indexes to load, as collection:method
+    eg. python3 ./code/server.py serve /tmp/ir.sock CISI_simplified:l CISI_simplified:s
+
+    bench: sys.argv[3] -> collection name, sys.argv[4] -> method,
+           sys.argv[5] -> 'ddd' scheme, sys.argv[6] -> k,
+           sys.argv[7] -> number of queries
+    eg. python3 ./code/server.py bench /tmp/ir.sock CISI_simplified l ltn 10 50
+    '''
+    n = len(sys.argv)
+
+    if n >= 4 and sys.argv[1] == 'serve':
+        indexes, signatures = {}, {}
+
+        # loading every requested index once.
+        for name in sys.argv[3:]:
+            if name.count(':') != 1 or name.split(':')[1] not in ['l','s']:
+                print("- Error: Indexes Must Be Given As collection:method. -")
+                sys.exit(1)
+            collection, method = name.split(':')
+            signatures[(collection, method)] = result_cache.base_signature(collection, method)
+            indexes[(collection, method)] = (query.read_index(collection, method), query.read_statistics(collection, method))
+
+        try:
+            asyncio.run(QueryServer(indexes, signatures).serve(sys.argv[2]))
+        except KeyboardInterrupt:
+            pass
+
+    elif n == 8 and sys.argv[1] == 'bench':
+        collection, method, scheme = sys.argv[3], sys.argv[4], sys.argv[5].lower()
+
+        # sampling the queries with a fixed seed, so both modes answer
+        # the same queries.
+        random.seed(0)
+        queries = read_queries(collection)
+        sample = random.choices(sorted(queries), k = int(sys.argv[7]))
+        requests = [{'id': i, 'collection': collection, 'method': method, 'scheme': scheme, 'k': int(sys.argv[6]), 'query': queries[i]} for i in sample]
+
+        report('query.py', *benchmark_cli(requests))
+        report('server (1 client)', *asyncio.run(benchmark_server(sys.argv[2], requests, 1)))
+        report('server (8 clients)', *asyncio.run(benchmark_server(sys.argv[2], requests, 8)))
+
+    else:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    exit(0)
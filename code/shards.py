@@ -0,0 +1,189 @@
+'''
+
+Scores queries over a document-partitioned (sharded) index.
+
+Each shard is held in memory by its own worker process, which scores a
+batch of queries against its range of documents and returns the k best
+of each. The per-shard lists are merged into the global top-k. Shards
+keep the global df of every term and the global N (see
+build_index.split_index), so the answers are identical to query.py on
+the full index.
+
+The program will be run from the root of the repository.
+
+'''
+
+import sys
+import json
+import time
+import itertools
+import multiprocessing
+from os.path import exists
+import query
+import topk
+from evaluation import read_queries
+
+def read_manifest(collection, method):
+    '''
+    Reads the shard manifest (inside the 'processed' folder), or returns
+    None if the index hasn't been sharded.
+    '''
+    manifest_file = './processed/' + collection + '_' + method + '_shards.json'
+
+    if not exists(manifest_file):
+        return None
+
+    file = open(manifest_file)
+    manifest = json.load(file)
+    file.close()
+
+    return manifest
+
+def read_shard(collection, method, shard):
+    '''
+    Reads the index and statistics table of one shard.
+    '''
+    prefix = './processed/' + collection + '_' + method + '_shard' + str(shard)
+
+    file = open(prefix + '.json')
+    index = json.load(file)
+    file.close()
+
+    file = open(prefix + '_stats.json')
+    statistics = json.load(file)
+    file.close()
+
+    # json keys are strings, so the docIDs are converted back.
+    statistics['documents'] = {int(docID): values for docID, values in statistics['documents'].items()}
+    return index, statistics
+
+def shard_worker(connection, collection, method, shard):
+    '''
+    Holds one shard in memory and answers batches of queries sent over
+    the connection, until it receives None. The shard is either its
+    number, read from the processed folder, or an (index, statistics)
+    pair.
+    '''
+    # the global bounds are valid (if looser) bounds for every shard.
+    bounds = None
+    if type(shard) == int:
+        index, statistics = read_shard(collection, method, shard)
+        bounds = query.read_bounds(collection, method)
+    else:
+        index, statistics = shard
+
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+
+        scheme, k, mode, keyword_queries = batch
+        connection.send([query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, statistics, mode, bounds)
+                         for keyword_query in keyword_queries])
+
+    connection.close()
+
+def merge_answers(answers, k):
+    '''
+    Merges the per-shard top-k lists of a query into the global top-k.
+    '''
+    # the global top-k is a subset of the shards' top-k lists, and topk
+    # applies the same (score, docID) cut-off and ordering.
+    return topk.select(((docID, score) for score, docID in itertools.chain(*answers)), k)
+
+class ShardedEngine:
+    '''
+    Starts a worker process per shard, and scores batches of queries on
+    all of them in parallel.
+    '''
+
+    def __init__(self, collection, method, shards = None):
+        '''
+        Uses the shards written by build_index.py, unless a list of
+        (index, statistics) shards is given.
+        '''
+        if shards is None:
+            manifest = read_manifest(collection, method)
+            if manifest is None:
+                print("- Error: Shards Don't Exist. -")
+                sys.exit(1)
+            shards = range(len(manifest['shards']))
+
+        self.connections = []
+        self.workers = []
+
+        for shard in shards:
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target = shard_worker, args = (worker_connection, collection, method, shard), daemon = True)
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def answer_batch(self, keyword_queries, scheme, k, mode = 'vector'):
+        '''
+        Returns the k highest ranked documents of every query, as
+        tokenize_and_answer would on the full index.
+        '''
+        # every shard receives the batch before any answer is read, so
+        # they all score at the same time.
+        for connection in self.connections:
+            connection.send((scheme, k, mode, keyword_queries))
+        answers = [connection.recv() for connection in self.connections]
+
+        return [merge_answers([shard_answers[i] for shard_answers in answers], k) for i in range(len(keyword_queries))]
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection name
+    sys.argv[2] -> 'ddd' scheme
+    sys.argv[3] -> lemmatization (l) or stemming (s)
+    sys.argv[4] -> number of documents wanted (k)
+    eg. python3 ./code/shards.py CISI_simplified ltn l 10
+
+    Scores the full query set on the shards and on the full index, and
+    reports whether the results match and the throughput of each.
+    '''
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 5:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    # checking if lemmatization (l) or stemming (s) is mentioned
+    if sys.argv[3] not in ['l','s']:
+        print("- Error: Incorrect Specification for Lemmatization or Stemming. - ")
+        sys.exit(1)
+
+    if not sys.argv[4].isdigit() or int(sys.argv[4]) <= 0:
+        print("- Error: Incorrect Number of Documents Requested. - ")
+        sys.exit(1)
+
+    collection, scheme, method, k = sys.argv[1], sys.argv[2].lower(), sys.argv[3], int(sys.argv[4])
+    queries = read_queries(collection)
+    keyword_queries = [queries[i] for i in sorted(queries)]
+
+    index = query.read_index(collection, method)
+    statistics = query.read_statistics(collection, method)
+
+    start = time.perf_counter()
+    expected = [query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], k, method, index, statistics) for keyword_query in keyword_queries]
+    single_time = time.perf_counter() - start
+
+    engine = ShardedEngine(collection, method)
+    start = time.perf_counter()
+    answers = engine.answer_batch(keyword_queries, scheme, k)
+    sharded_time = time.perf_counter() - start
+    engine.close()
+
+    print(scheme, ': match = ', answers == expected, ', shards = ', len(engine.workers), ', queries/s (single / sharded) = ',
+          round(len(keyword_queries) / single_time, 1), '/', round(len(keyword_queries) / sharded_time, 1))
+
+    exit(0)
@@ -0,0 +1,227 @@
+'''
+
+Generates synthetic collections for scaling tests.
+
+The term statistics of a real collection are fitted first: a Zipf
+exponent for the word frequencies, Heaps' law for the growth of the
+vocabulary, and the distribution of document lengths. A collection of
+any size is then written in the same .I/.T/.A/.W/.X format, with its
+.QRY and .REL files: every query has a few topic words, which are
+planted in the documents marked relevant to it.
+
+The program will be run from the root of the repository.
+
+'''
+
+import re
+import sys
+import math
+import random
+import itertools
+from os.path import exists
+from build_index import read_documents
+
+WORD = re.compile(r'[a-z]+')
+
+CONSONANTS = 'bcdfghjklmnprstvz'
+VOWELS = 'aeiou'
+
+def least_squares(xs, ys):
+    '''
+    Returns the (slope, intercept) of the least squares line.
+    '''
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+    return slope, mean_y - slope * mean_x
+
+def fit_statistics(collection):
+    '''
+    Fits the term statistics of a collection: the words by decreasing
+    frequency, the Zipf exponent, the Heaps' law constants (V = K * n^beta)
+    and the document lengths.
+    '''
+    frequencies = {}
+    lengths = []
+    growth = []
+    tokens = 0
+
+    for docID, text in read_documents(collection).items():
+        words = WORD.findall(text.lower())
+        lengths.append(len(words))
+        for word in words:
+            frequencies[word] = frequencies.get(word, 0) + 1
+        tokens += len(words)
+        growth.append((tokens, len(frequencies)))
+
+    vocabulary = sorted(frequencies, key = lambda word: (-frequencies[word], word))
+
+    # the words seen once bend the tail of the curve, so they are left out
+    # of the fit.
+    ranked = [(rank, frequencies[word]) for rank, word in enumerate(vocabulary, 1) if frequencies[word] > 1]
+    slope, intercept = least_squares([math.log(rank) for rank, frequency in ranked], [math.log(frequency) for rank, frequency in ranked])
+
+    beta, log_k = least_squares([math.log(n) for n, v in growth], [math.log(v) for n, v in growth])
+
+    return {'vocabulary': vocabulary, 'zipf_exponent': -slope, 'heaps_k': math.exp(log_k), 'heaps_beta': beta, 'lengths': lengths}
+
+def synthetic_words(known):
+    '''
+    Yields pronounceable made-up words (consonant-vowel syllables) that
+    are not in the known vocabulary.
+    '''
+    syllables = [consonant + vowel for consonant in CONSONANTS for vowel in VOWELS]
+
+    for count in itertools.count(2):
+        for parts in itertools.product(syllables, repeat = count):
+            word = ''.join(parts)
+            if word not in known:
+                yield word
+
+def build_vocabulary(fitted, documents):
+    '''
+    Returns the ranked vocabulary of a collection of the given size, with
+    its cumulative Zipf weights.
+    '''
+    total_tokens = documents * sum(fitted['lengths']) / len(fitted['lengths'])
+    size = max(int(fitted['heaps_k'] * total_tokens ** fitted['heaps_beta']), 1)
+
+    vocabulary = fitted['vocabulary'][:size]
+    if len(vocabulary) < size:
+        vocabulary += list(itertools.islice(synthetic_words(set(vocabulary)), size - len(vocabulary)))
+
+    weights = itertools.accumulate(1 / rank ** fitted['zipf_exponent'] for rank in range(1, size + 1))
+    return vocabulary, list(weights)
+
+def plan_queries(generator, vocabulary, documents, queries):
+    '''
+    Picks the topic words and the relevant documents of every query.
+    Returns the queries, and docID -> list of the queries it is relevant to.
+    '''
+    # topic words come from the middle of the vocabulary: frequent enough
+    # to appear in the index, rare enough to discriminate.
+    start = min(100, len(vocabulary) // 10)
+    middle = vocabulary[start:max(len(vocabulary) // 2, start + 1)]
+
+    plans = []
+    relevant = {}
+    for query_id in range(1, queries + 1):
+        topic = generator.sample(middle, min(generator.randint(3, 6), len(middle)))
+        docIDs = sorted(generator.sample(range(1, documents + 1), min(generator.randint(5, 40), documents)))
+        plans.append((query_id, topic, docIDs))
+        for docID in docIDs:
+            relevant.setdefault(docID, []).append(topic)
+
+    return plans, relevant
+
+def wrap(words, width = 60):
+    '''
+    Joins words into lines of about 'width' characters.
+    '''
+    lines, line = [], []
+    for word in words:
+        line.append(word)
+        if sum(len(current) + 1 for current in line) > width:
+            lines.append(' '.join(line))
+            line = []
+    if line:
+        lines.append(' '.join(line))
+    return '\n'.join(lines)
+
+def write_collection(source, name, documents, queries, seed = 0):
+    '''
+    Writes collections/<name>.ALL, .QRY and .REL with the given number
+    of documents and queries, fitted to the source collection.
+    '''
+    prefix = './collections/' + name
+
+    # checks if it is a valid file.
+    if exists(prefix + '.ALL'):
+        print("- Error: Collection File Already Exists. -")
+        sys.exit(1)
+
+    generator = random.Random(seed)
+    fitted = fit_statistics(source)
+    vocabulary, weights = build_vocabulary(fitted, documents)
+    plans, relevant = plan_queries(generator, vocabulary, documents, queries)
+
+    # streaming the documents, so the collection never sits in memory.
+    file = open(prefix + '.ALL', 'w')
+    for docID in range(1, documents + 1):
+        length = max(generator.choice(fitted['lengths']), 1)
+        words = generator.choices(vocabulary, cum_weights = weights, k = length)
+
+        # planting the topic words of the queries the document is
+        # relevant to.
+        for topic in relevant.get(docID, []):
+            for _ in range(generator.randint(2, 6)):
+                words.insert(generator.randrange(len(words) + 1), generator.choice(topic))
+
+        title = generator.choices(vocabulary, cum_weights = weights, k = generator.randint(3, 10))
+        author = generator.choice(vocabulary).capitalize() + ', ' + generator.choice(CONSONANTS).upper() + '.'
+
+        file.write('.I ' + str(docID) + '\n')
+        file.write('.T\n' + ' '.join(title).capitalize() + '\n')
+        file.write('.A\n' + author + '\n')
+        file.write('.W\n' + wrap(words) + '\n')
+        file.write('.X\n')
+        for reference in sorted(generator.sample(range(1, documents + 1), min(3, documents))):
+            file.write(str(reference) + '\t5\t' + str(docID) + '\n')
+    file.close()
+
+    # a query is its topic words among a few common words.
+    file = open(prefix + '.QRY', 'w')
+    for query_id, topic, docIDs in plans:
+        words = topic + generator.sample(vocabulary[:50], min(generator.randint(2, 8), len(vocabulary)))
+        generator.shuffle(words)
+        file.write('.I ' + str(query_id) + '\n.W\n' + wrap(words).capitalize() + '?\n')
+    file.close()
+
+    file = open(prefix + '.REL', 'w')
+    for query_id, topic, docIDs in plans:
+        for docID in docIDs:
+            file.write('\t' + str(query_id) + '\t' + str(docID) + '\n')
+    file.close()
+
+    return fitted
+
+if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> collection the statistics are fitted to
+    sys.argv[2] -> name of the synthetic collection
+    sys.argv[3] -> number of documents
+    --queries=N -> number of queries (defaults to 100)
+    --seed=N -> random seed (defaults to 0)
+    eg. python3 ./code/synthetic.py CISI_simplified SYNTHETIC_100k 100000
+    '''
+    # removing the optional flags before checking the arguments.
+    queries, seed = 100, 0
+    for argument in sys.argv[1:]:
+        for flag in ['--queries=', '--seed=']:
+            if argument.startswith(flag):
+                if not argument[len(flag):].isdigit():
+                    print("- Error: Invalid Value For " + flag[2:-1].capitalize() + ". -")
+                    sys.exit(1)
+                if flag == '--queries=':
+                    queries = int(argument[len(flag):])
+                else:
+                    seed = int(argument[len(flag):])
+    sys.argv = [argument for argument in sys.argv if not argument.startswith('--')]
+
+    n = len(sys.argv)
+
+    # Checking if correct number of command line arguements are provided
+    if n != 4:
+        print("- Error: Incorrect Number of Arguments -")
+        sys.exit(1)
+
+    if not sys.argv[3].isdigit() or int(sys.argv[3]) <= 0:
+        print("- Error: Invalid Number of Documents. -")
+        sys.exit(1)
+
+    fitted = write_collection(sys.argv[1], sys.argv[2], int(sys.argv[3]), queries, seed)
+    print('zipf exponent = ', round(fitted['zipf_exponent'], 3), ', heaps K = ', round(fitted['heaps_k'], 2), ', heaps beta = ', round(fitted['heaps_beta'], 3))
+
+    print("SUCCESS")
+    exit(0)
@@ -1,9 +1,23 @@
 '''
 
-Testfile which runs evaluation.py a certain number of times.
+Testfile which runs the evaluation grid a certain number of times.
+
+Every (query, scheme, method) is scored once at the deepest k, and the
+metrics engine (evaluation.py) computes all the metrics of the query at
+every k in one pass over this ranking. Each cell of the grid averages
+these per-query metrics over its sampled queries, and the per-query
+breakdown is written to per_query.json for significance testing.
 
 '''
-import subprocess
+import sys
+import random
+import multiprocessing
+import json
+import query
+from evaluation import read_queries
+from evaluation import read_relevance
+from evaluation import evaluate_rankings
+from evaluation import mean_metrics
 
 # setting up all our possibilities for each argument provided to
 # evaluation.py.
@@ -12,41 +26,124 @@ collection = "CISI_simplified"
 scoring_schemes = ['ltn', 'lnn', 'nnn', 'ntn', 'ltc', 'lnc', 'nnc', 'ntc']
 methods = ['l', 's']
 metrics = ['mrr', 'map']
+documents = [10, 860, 1710]
+random_queries = [10, 80]
+
+indexes = {}
+
+def load_worker_indexes(collection, methods):
+    '''
+    Initializes a pool worker by loading the index of every method once.
+    '''
+    for method in methods:
+        indexes[method] = (query.read_index(collection, method), query.read_statistics(collection, method))
+
+def score(arguments):
+    '''
+    Scores one (query, scheme, method) at the given depth, and returns
+    the ranking as (score, docID) pairs.
+    '''
+    query_id, keyword_query, scheme, method, depth = arguments
+    index, statistics = indexes[method]
+    answer = query.tokenize_and_answer(keyword_query, scheme[0], scheme[1], scheme[2], depth, method, index, statistics)
+    return (scheme, method, query_id), answer
+
+def rank_all(collection, queries, workers):
+    '''
+    Scores every query once per scheme and method at the deepest k,
+    spreading the work over a pool of worker processes.
+    '''
+    depth = max(documents)
+    arguments = [(i, queries[i], scheme, method, depth) for scheme in scoring_schemes for method in methods for i in queries]
+
+    pool = multiprocessing.Pool(workers, load_worker_indexes, (collection, methods))
+    rankings = dict(pool.imap_unordered(score, arguments, chunksize = 8))
+    pool.close()
+    pool.join()
+
+    return rankings
+
+def breakdown(rankings, relevance):
+    '''
+    Computes the metrics of every query at every k, per scheme and
+    method, from the rankings at the deepest k.
+    '''
+    per_query = {}
+    for scheme in scoring_schemes:
+        for method in methods:
+            deepest = {query_id: ranking for (ranked_scheme, ranked_method, query_id), ranking in rankings.items() if (ranked_scheme, ranked_method) == (scheme, method)}
+            per_query[(scheme, method)] = evaluate_rankings(relevance, deepest, documents)
+    return per_query
+
+def write_breakdown(per_query, file_name):
+    '''
+    Writes the per-query metrics as scheme -> method -> query ID -> k ->
+    metric -> value.
+    '''
+    output = {}
+    for (scheme, method), metrics in per_query.items():
+        output.setdefault(scheme, {})[method] = metrics
+
+    file = open(file_name, 'w')
+    json.dump(output, file)
+    file.close()
+
+def repeat_funct(run_number, queries, per_query):
 
-def repeat_funct(run_number):
-    
     # writing our outputs into files (mainly to avoid the ntlk printing).
     file_name = "sample" + run_number + ".txt"
     file = open(file_name, 'w')
 
     # retrieving documents [10, 860, 1710] with query.py.
-    for k in [10, 860, 1710]:
-        
-        # randomly selecting [10, 80] queries with evaluation.py. 
-        for r in [10, 80]:
-            
+    for k in documents:
+
+        # randomly selecting [10, 80] queries with evaluation.py.
+        for r in random_queries:
+
             print("documents: " + str(k) + " queries: " + str(r), file = file)
 
             # selecting a scoring scheme from ['ltn', 'lnn', 'nnn', 'ntn', 'ltc', 'lnc', 'nnc', 'ntc'].
             for scheme in scoring_schemes:
-                
+
                 # selecting a method from ['l', 's'].
                 for method in methods:
-                    
+
                     # selecting a metric from ['mrr', 'map'].
                     for metric in metrics:
-                        output = subprocess.check_output(["python3", program, collection, scheme, method, str(k), str(r), metric])
-                        output = output.decode('utf-8').strip()
-                        file.write(output)
-                        file.write('\n')
-                    
+
+                        # every cell samples its own queries, as each run of
+                        # evaluation.py did.
+                        sample = random.choices(sorted(queries), k = r)
+                        means = mean_metrics(per_query[(scheme, method)], sample, r)
+                        result = means[k][metric] if means else 0
+
+                        print('Program : ', program, ', Collection : ', collection, ', Scheme : ', scheme, ', Method : ', method, ', K : ', k, ', Random : ', r, ', Metric : ', metric, ' = ', str(result), file = file)
+
                     print("-" * 100, file=file)
         file.write('\n')
     file.close()
 
 if __name__ == "__main__":
+    '''
+    main() function
+    sys.argv[1] -> number of worker processes (optional, defaults to
+                   the number of cores)
+    '''
+    workers = multiprocessing.cpu_count()
+    if len(sys.argv) == 2:
+        if not sys.argv[1].isdigit() or int(sys.argv[1]) <= 0:
+            print("- Error: Invalid Number of Workers. - ")
+            sys.exit(1)
+        workers = int(sys.argv[1])
+
+    # scoring every query once for the whole grid.
+    queries = read_queries(collection)
+    relevance = read_relevance(collection)
+    rankings = rank_all(collection, queries, workers)
+    per_query = breakdown(rankings, relevance)
+    write_breakdown(per_query, "per_query.json")
+
     # running this scoring twice.
-    # NOTE: this program takes roughly 3-4 hours.
     for i in range(2):
         temp = i + 1
-        repeat_funct(str(temp))
+        repeat_funct(str(temp), queries, per_query)
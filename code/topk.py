@@ -0,0 +1,110 @@
+'''
+Top-k selection of scored documents.
+
+Documents are kept in a min-heap of size k while the scores stream in,
+keyed by (score, docID): among documents tied at the cut-off, the ones
+with the largest docIDs are kept, as heapq.nlargest did in
+utils.largest. The answer is ordered exactly as utils.largest returns
+it: by decreasing score and, within a tie, by increasing docID (see
+order for the one exception).
+'''
+import heapq
+
+class TopK:
+    '''
+    Keeps the k largest (score, docID) pairs pushed so far.
+    '''
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    def push(self, score, docID):
+        '''
+        Offers a document, replacing the smallest one kept if the heap
+        is full and the document beats it.
+        '''
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (score, docID))
+        elif (score, docID) > self.heap[0]:
+            heapq.heapreplace(self.heap, (score, docID))
+
+    def full(self):
+        return len(self.heap) == self.k
+
+    def threshold(self):
+        '''
+        Returns the smallest score kept once the heap is full, otherwise
+        -inf (any document can enter).
+        '''
+        if self.full():
+            return self.heap[0][0]
+        return float('-inf')
+
+    def documents(self):
+        '''
+        Returns the kept documents as a dictionary of docID -> score.
+        '''
+        return {docID: score for score, docID in self.heap}
+
+    def answer(self):
+        '''
+        Returns the kept documents as a list of (score, docID), ordered
+        like utils.largest.
+        '''
+        return order(sorted(self.heap, reverse = True))
+
+def order(ranked):
+    '''
+    Reorders a list of (score, docID) sorted by decreasing (score, docID)
+    so that ties are listed by increasing docID, in one pass.
+    '''
+    answer = []
+    start = 0
+
+    while start < len(ranked):
+        end = start
+        while end < len(ranked) and ranked[end][0] == ranked[start][0]:
+            end += 1
+        group = ranked[start:end]
+
+        # utils.largest walks every tie back to the start of its group.
+        # For the very first group the walk wraps around to the end of
+        # the list, leaving its largest docID last and the rest in
+        # decreasing order; this is kept so the output doesn't change.
+        if start == 0 and len(group) > 1:
+            answer.extend(group[1:])
+            answer.append(group[0])
+        else:
+            answer.extend(reversed(group))
+        start = end
+
+    return answer
+
+def select(scored, k):
+    '''
+    Returns the k highest scored documents of an iterable of
+    (docID, score) pairs, ordered like utils.largest.
+    '''
+    selector = TopK(k)
+    for docID, score in scored:
+        selector.push(score, docID)
+    return selector.answer()
+
+def select_dense(scores, docIDs, k):
+    '''
+    Returns the k highest scored documents of a dense NumPy array of
+    scores (one per docID, in the same order), ordered like
+    utils.largest.
+    '''
+    import numpy as np
+
+    # argpartition finds the k-th largest score; every document tied
+    # with it is kept so the docID tie-break is applied as usual.
+    if len(scores) > k:
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        selected = np.flatnonzero(scores >= threshold)
+        scores, docIDs = scores[selected], docIDs[selected]
+
+    ranked = sorted(zip(scores.tolist(), docIDs.tolist()), reverse = True)[:k]
+    return order(ranked)
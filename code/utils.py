@@ -4,10 +4,30 @@ Additional functions to assist in query.py.
 import math
 import heapq
 
-def number_of_documents(index):
+# the tf/idf weightings whose full-vector norms are stored in the
+# document statistics table.
+weightings = ['ln', 'lt', 'nn', 'nt']
+
+# the tf/idf weightings whose per-term maximum weights are stored for
+# dynamic pruning.
+bounded_weightings = ['ln', 'lt', 'nn', 'nt', 'bn', 'bt']
+
+# BM25 parameters.
+k1 = 1.2
+b = 0.75
+
+def number_of_documents(index, statistics = None):
     '''
     Computes the total number of documents in the index.
     '''
+    # the document statistics table stores N at build time.
+    if statistics is not None:
+        return statistics['N']
+
+    # the binary index stores the number of documents in its header.
+    if hasattr(index, 'num_documents'):
+        return index.num_documents
+
     count = 0
     encounterred_documents = {}
 
@@ -34,6 +54,13 @@ def tf_compute(tf_scheme, freq):
     # returns the natural tf.
     return freq
     
+def bm25_compute(freq, length, average_length):
+    '''
+    Computes the BM25 tf score, given the frequency of the term and the
+    length of the document against the average document length.
+    '''
+    return (freq * (k1 + 1)) / (freq + k1 * (1 - b + b * length / average_length))
+
 def df_compute(df_scheme, total_size, raw_freq):
     '''
     Computes the idf score, given the scheme, total number of
@@ -110,3 +137,14 @@ def largest(min_heap, n):
             answer.insert(temp, (k, v))
             
     return answer
+
+def percentile(values, p):
+    '''
+    Returns the p-th percentile (0 to 100) of a list of values,
+    using the nearest-rank method.
+    '''
+    assert len(values) > 0
+
+    ordered = sorted(values)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]